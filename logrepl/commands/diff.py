@@ -0,0 +1,863 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import contextlib
+import threading
+import psycopg
+from loguru import logger
+from logrepl.db import target_db
+from logrepl.db import source_db
+from logrepl.commands.schema import create_database
+from logrepl.config import schemas as configured_schemas
+
+
+KINDS = [
+    "schemas",
+    "extensions",
+    "types",
+    "sequences",
+    "functions",
+    "tables",
+    "constraints",
+    "indexes",
+    "views",
+    "triggers",
+    "sequence_owners",
+]
+# Objects created by initdb have lower OIDs, dependencies on them always hold.
+FIRST_NORMAL_OID = 16384
+
+
+def fetch_rows(conn, query, args=None):
+    with conn.cursor() as cur:
+        cur.execute(query, args)
+        return cur.fetchall()
+
+
+def empty_catalog():
+    catalog = {kind: {} for kind in KINDS}
+    # (kind, name) -> set of (kind, name) it depends on, from pg_depend.
+    catalog["dependencies"] = {}
+    return catalog
+
+
+def fetch_catalog(conn, schemas=("public",)):
+    """
+    Read the objects logrepl knows how to converge, keyed by quoted name, and
+    the dependencies between them. Partitioned tables are not handled.
+    """
+    schemas = list(schemas)
+    catalog = empty_catalog()
+    # (catalog table, oid) -> (kind, name) of the object it belongs to, so rows,
+    # array types, rewrite rules, defaults and constraint indexes resolve to the
+    # table, type, view or constraint logrepl creates.
+    ids = {}
+
+    for oid, name in fetch_rows(
+        conn,
+        "SELECT oid, quote_ident(nspname) FROM pg_namespace WHERE nspname = ANY(%s)",
+        [schemas],
+    ):
+        catalog["schemas"][name] = name
+        ids[("pg_namespace", oid)] = ("schemas", name)
+
+    for oid, name in fetch_rows(
+        conn,
+        "SELECT oid, quote_ident(extname) FROM pg_extension WHERE extname <> 'plpgsql' ORDER BY oid",
+    ):
+        catalog["extensions"][name] = name
+        ids[("pg_extension", oid)] = ("extensions", name)
+
+    for classid, objid, array, name in fetch_rows(
+        conn,
+        """
+        SELECT d.classid::regclass::text, d.objid, t.typarray, quote_ident(e.extname)
+        FROM pg_depend d
+        JOIN pg_extension e ON e.oid = d.refobjid
+        LEFT JOIN pg_type t ON d.classid = 'pg_type'::regclass AND t.oid = d.objid
+        WHERE d.refclassid = 'pg_extension'::regclass AND d.deptype = 'e'
+        """,
+    ):
+        ids[(classid, objid)] = ("extensions", name)
+        if array:
+            ids[("pg_type", array)] = ("extensions", name)
+
+    fetch_types(conn, schemas, catalog, ids)
+
+    for oid, name, *options in fetch_rows(
+        conn,
+        """
+        SELECT c.oid, quote_ident(s.schemaname) || '.' || quote_ident(s.sequencename),
+               s.data_type::text, s.increment_by, s.min_value, s.max_value,
+               s.start_value, s.cycle
+        FROM pg_sequences s
+        JOIN pg_class c ON c.relname = s.sequencename
+        JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = s.schemaname
+        WHERE s.schemaname = ANY(%s)
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_depend d
+              WHERE d.classid = 'pg_class'::regclass AND d.objid = c.oid AND d.deptype = 'i'
+          )
+        """,
+        [schemas],
+    ):
+        catalog["sequences"][name] = tuple(options)
+        ids[("pg_class", oid)] = ("sequences", name)
+
+    for oid, name, definition in fetch_rows(
+        conn,
+        """
+        SELECT p.oid,
+               quote_ident(n.nspname) || '.' || quote_ident(p.proname)
+                   || '(' || pg_get_function_identity_arguments(p.oid) || ')',
+               pg_get_functiondef(p.oid)
+        FROM pg_proc p
+        JOIN pg_namespace n ON n.oid = p.pronamespace
+        WHERE n.nspname = ANY(%s)
+          AND p.prokind IN ('f', 'p')
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_depend d
+              WHERE d.classid = 'pg_proc'::regclass AND d.objid = p.oid AND d.deptype = 'e'
+          )
+        """,
+        [schemas],
+    ):
+        catalog["functions"][name] = definition
+        ids[("pg_proc", oid)] = ("functions", name)
+
+    for (
+        oid,
+        row_type,
+        row_array,
+        default_oid,
+        table,
+        column,
+        type_name,
+        not_null,
+        default,
+        identity,
+        generated,
+    ) in fetch_rows(
+        conn,
+        """
+        SELECT c.oid, c.reltype, t.typarray, d.oid,
+               quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+               quote_ident(a.attname),
+               format_type(a.atttypid, a.atttypmod),
+               a.attnotnull,
+               pg_get_expr(d.adbin, d.adrelid),
+               a.attidentity::text,
+               a.attgenerated::text
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_type t ON t.oid = c.reltype
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        LEFT JOIN pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+        WHERE n.nspname = ANY(%s)
+          AND c.relkind = 'r'
+          AND NOT c.relispartition
+        ORDER BY c.oid, a.attnum
+        """,
+        [schemas],
+    ):
+        catalog["tables"].setdefault(table, {})[column] = (
+            type_name,
+            not_null,
+            default,
+            identity,
+            generated,
+        )
+        # Functions taking or returning the table's row type depend on the table.
+        ids[("pg_class", oid)] = ("tables", table)
+        ids[("pg_type", row_type)] = ("tables", table)
+        ids[("pg_type", row_array)] = ("tables", table)
+        if default_oid is not None:
+            ids[("pg_attrdef", default_oid)] = ("tables", table)
+
+    for oid, index_oid, table, name, contype, definition in fetch_rows(
+        conn,
+        """
+        SELECT con.oid, con.conindid,
+               quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+               quote_ident(con.conname),
+               con.contype::text,
+               pg_get_constraintdef(con.oid)
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = ANY(%s)
+          AND con.contype IN ('p', 'u', 'c', 'x', 'f')
+          AND con.conislocal
+        """,
+        [schemas],
+    ):
+        key = f"{table}.{name}"
+        catalog["constraints"][key] = (table, name, contype, definition)
+        ids[("pg_constraint", oid)] = ("constraints", key)
+        # Foreign keys depend on the index backing the referenced key.
+        if contype in ("p", "u", "x"):
+            ids[("pg_class", index_oid)] = ("constraints", key)
+
+    for oid, name, definition in fetch_rows(
+        conn,
+        """
+        SELECT i.oid,
+               quote_ident(n.nspname) || '.' || quote_ident(i.relname),
+               pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class c ON c.oid = x.indrelid
+        JOIN pg_namespace n ON n.oid = i.relnamespace
+        WHERE n.nspname = ANY(%s)
+          AND c.relkind IN ('r', 'm')
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_constraint con
+              WHERE con.conindid = i.oid AND con.contype IN ('p', 'u', 'x')
+          )
+        """,
+        [schemas],
+    ):
+        catalog["indexes"][name] = definition
+        ids[("pg_class", oid)] = ("indexes", name)
+
+    for oid, rule_oid, name, relkind, definition in fetch_rows(
+        conn,
+        """
+        SELECT c.oid, r.oid,
+               quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+               c.relkind::text,
+               pg_get_viewdef(c.oid)
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_rewrite r ON r.ev_class = c.oid AND r.rulename = '_RETURN'
+        WHERE n.nspname = ANY(%s)
+          AND c.relkind IN ('v', 'm')
+        ORDER BY c.oid
+        """,
+        [schemas],
+    ):
+        catalog["views"][name] = (relkind, definition.rstrip().rstrip(";"))
+        ids[("pg_class", oid)] = ("views", name)
+        ids[("pg_rewrite", rule_oid)] = ("views", name)
+
+    for oid, table, name, definition in fetch_rows(
+        conn,
+        """
+        SELECT t.oid,
+               quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+               quote_ident(t.tgname),
+               pg_get_triggerdef(t.oid)
+        FROM pg_trigger t
+        JOIN pg_class c ON c.oid = t.tgrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = ANY(%s)
+          AND NOT t.tgisinternal
+          AND NOT c.relispartition
+        ORDER BY t.oid
+        """,
+        [schemas],
+    ):
+        key = f"{table}.{name}"
+        catalog["triggers"][key] = (table, name, definition)
+        ids[("pg_trigger", oid)] = ("triggers", key)
+
+    # OWNED BY is set once both the sequence and the table exist.
+    for sequence, table, column in fetch_rows(
+        conn,
+        """
+        SELECT quote_ident(sn.nspname) || '.' || quote_ident(s.relname),
+               quote_ident(tn.nspname) || '.' || quote_ident(t.relname),
+               quote_ident(a.attname)
+        FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        JOIN pg_namespace sn ON sn.oid = s.relnamespace
+        JOIN pg_class t ON t.oid = d.refobjid
+        JOIN pg_namespace tn ON tn.oid = t.relnamespace
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = d.refobjsubid
+        WHERE d.classid = 'pg_class'::regclass
+          AND d.refclassid = 'pg_class'::regclass
+          AND d.deptype = 'a'
+          AND sn.nspname = ANY(%s)
+        """,
+        [schemas],
+    ):
+        if sequence in catalog["sequences"]:
+            catalog["sequence_owners"][sequence] = f"{table}.{column}"
+            catalog["dependencies"][("sequence_owners", sequence)] = {
+                ("sequences", sequence),
+                ("tables", table),
+            }
+
+    for classid, objid, refclassid, refobjid, deptype in fetch_rows(
+        conn,
+        """
+        SELECT classid::regclass::text, objid, refclassid::regclass::text, refobjid,
+               deptype::text
+        FROM pg_depend
+        WHERE objid >= %s AND refobjid >= %s AND deptype IN ('n', 'a')
+        """,
+        [FIRST_NORMAL_OID, FIRST_NORMAL_OID],
+    ):
+        key = ids.get((classid, objid))
+        reference = ids.get((refclassid, refobjid))
+        if key is None or reference is None or key == reference:
+            continue
+        # A serial sequence is owned by its table but created before it.
+        if key[0] == "sequences" and deptype == "a":
+            continue
+        catalog["dependencies"].setdefault(key, set()).add(reference)
+
+    return catalog
+
+
+def fetch_types(conn, schemas, catalog, ids):
+    """
+    Read enum, domain, composite and range types. Each is stored as a tuple
+    starting with its pg_type.typtype.
+    """
+    names = {}
+    for oid, array, relid, name, typtype, base, not_null, default in fetch_rows(
+        conn,
+        """
+        SELECT t.oid, t.typarray, t.typrelid,
+               quote_ident(n.nspname) || '.' || quote_ident(t.typname),
+               t.typtype::text,
+               format_type(t.typbasetype, t.typtypmod),
+               t.typnotnull,
+               t.typdefault
+        FROM pg_type t
+        JOIN pg_namespace n ON n.oid = t.typnamespace
+        LEFT JOIN pg_class c ON c.oid = t.typrelid
+        WHERE n.nspname = ANY(%s)
+          AND t.typtype IN ('e', 'd', 'c', 'r')
+          AND (t.typtype <> 'c' OR c.relkind = 'c')
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_depend d
+              WHERE d.classid = 'pg_type'::regclass AND d.objid = t.oid AND d.deptype = 'e'
+          )
+        ORDER BY t.oid
+        """,
+        [schemas],
+    ):
+        names[oid] = name
+        ids[("pg_type", oid)] = ("types", name)
+        ids[("pg_type", array)] = ("types", name)
+        if typtype == "e":
+            catalog["types"][name] = ("e", [])
+        elif typtype == "d":
+            catalog["types"][name] = ("d", base, not_null, default, {})
+        elif typtype == "c":
+            catalog["types"][name] = ("c", {})
+            ids[("pg_class", relid)] = ("types", name)
+
+    for oid, label in fetch_rows(
+        conn,
+        "SELECT enumtypid, enumlabel::text FROM pg_enum ORDER BY enumtypid, enumsortorder",
+    ):
+        if oid in names:
+            catalog["types"][names[oid]][1].append(label)
+
+    for oid, type_oid, name, definition in fetch_rows(
+        conn,
+        """
+        SELECT oid, contypid, quote_ident(conname), pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE contypid <> 0 AND contype = 'c'
+        """,
+    ):
+        if type_oid in names:
+            catalog["types"][names[type_oid]][4][name] = definition
+            ids[("pg_constraint", oid)] = ("types", names[type_oid])
+
+    for oid, attribute, type_name in fetch_rows(
+        conn,
+        """
+        SELECT t.oid, quote_ident(a.attname), format_type(a.atttypid, a.atttypmod)
+        FROM pg_type t
+        JOIN pg_attribute a ON a.attrelid = t.typrelid AND a.attnum > 0 AND NOT a.attisdropped
+        WHERE t.typtype = 'c'
+        ORDER BY t.oid, a.attnum
+        """,
+    ):
+        if oid in names:
+            catalog["types"][names[oid]][1][attribute] = type_name
+
+    for oid, subtype, opclass, subtype_diff, canonical in fetch_rows(
+        conn,
+        """
+        SELECT r.rngtypid,
+               format_type(r.rngsubtype, NULL),
+               CASE WHEN NOT opc.opcdefault THEN quote_ident(opc.opcname) END,
+               CASE WHEN r.rngsubdiff <> 0 THEN r.rngsubdiff::regproc::text END,
+               CASE WHEN r.rngcanonical <> 0 THEN r.rngcanonical::regproc::text END
+        FROM pg_range r
+        JOIN pg_opclass opc ON opc.oid = r.rngsubopc
+        """,
+    ):
+        if oid in names:
+            catalog["types"][names[oid]] = (
+                "r",
+                subtype,
+                opclass,
+                subtype_diff,
+                canonical,
+            )
+
+
+def quote_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def column_definition(column, type_name, not_null, default, identity, generated):
+    definition = f"{column} {type_name}"
+    if generated == "s":
+        definition += f" GENERATED ALWAYS AS ({default}) STORED"
+    elif default is not None:
+        definition += f" DEFAULT {default}"
+    if identity == "a":
+        definition += " GENERATED ALWAYS AS IDENTITY"
+    elif identity == "d":
+        definition += " GENERATED BY DEFAULT AS IDENTITY"
+    if not_null:
+        definition += " NOT NULL"
+    return definition
+
+
+def sequence_options(data_type, increment, minimum, maximum, start, cycle):
+    return (
+        f"AS {data_type} INCREMENT BY {increment} MINVALUE {minimum} "
+        f"MAXVALUE {maximum} START WITH {start} {'CYCLE' if cycle else 'NO CYCLE'}"
+    )
+
+
+def create_type(name, definition):
+    typtype = definition[0]
+    if typtype == "e":
+        values = ", ".join(quote_literal(label) for label in definition[1])
+        return [f"CREATE TYPE {name} AS ENUM ({values})"]
+    if typtype == "d":
+        _, base, not_null, default, constraints = definition
+        statement = f"CREATE DOMAIN {name} AS {base}"
+        if default is not None:
+            statement += f" DEFAULT {default}"
+        if not_null:
+            statement += " NOT NULL"
+        for constraint, check in constraints.items():
+            statement += f" CONSTRAINT {constraint} {check}"
+        return [statement]
+    if typtype == "c":
+        attributes = ", ".join(f"{a} {t}" for a, t in definition[1].items())
+        return [f"CREATE TYPE {name} AS ({attributes})"]
+    _, subtype, opclass, subtype_diff, canonical = definition
+    if canonical is not None:
+        logger.warning(f"Range type {name} has a canonical function, not handled")
+        return []
+    options = f"SUBTYPE = {subtype}"
+    if opclass is not None:
+        options += f", SUBTYPE_OPCLASS = {opclass}"
+    if subtype_diff is not None:
+        options += f", SUBTYPE_DIFF = {subtype_diff}"
+    return [f"CREATE TYPE {name} AS RANGE ({options})"]
+
+
+def diff_enum(name, labels, target_labels):
+    """
+    Add the missing labels at the position they have on the source. Labels
+    cannot be reordered, so a target with the same labels in a different order
+    is left as is.
+    """
+    statements = []
+    present = list(target_labels)
+    for i, label in enumerate(labels):
+        if label in present:
+            continue
+        if i > 0:
+            position = f" AFTER {quote_literal(labels[i - 1])}"
+        else:
+            following = [label for label in labels if label in present]
+            position = f" BEFORE {quote_literal(following[0])}" if following else ""
+        statements.append(
+            f"ALTER TYPE {name} ADD VALUE {quote_literal(label)}{position}"
+        )
+        present.append(label)
+    return statements
+
+
+def diff_type(name, definition, target_definition):
+    typtype = definition[0]
+    if typtype != target_definition[0]:
+        logger.warning(f"Type {name} is a different kind of type on target, skipping")
+        return []
+    if typtype == "e":
+        return diff_enum(name, definition[1], target_definition[1])
+    if typtype == "c":
+        statements = []
+        for attribute, type_name in definition[1].items():
+            target_type = target_definition[1].get(attribute)
+            if target_type is None:
+                statements.append(
+                    f"ALTER TYPE {name} ADD ATTRIBUTE {attribute} {type_name}"
+                )
+            elif target_type != type_name:
+                statements.append(
+                    f"ALTER TYPE {name} ALTER ATTRIBUTE {attribute} TYPE {type_name}"
+                )
+        return statements
+    if typtype == "r":
+        if definition != target_definition:
+            logger.warning(f"Range type {name} differs on target, cannot be altered")
+        return []
+
+    _, base, not_null, default, constraints = definition
+    _, target_base, target_not_null, target_default, target_constraints = (
+        target_definition
+    )
+    if base != target_base:
+        logger.warning(f"Domain {name} has another base type on target, skipping")
+        return []
+    statements = []
+    if default != target_default:
+        if default is None:
+            statements.append(f"ALTER DOMAIN {name} DROP DEFAULT")
+        else:
+            statements.append(f"ALTER DOMAIN {name} SET DEFAULT {default}")
+    if not_null != target_not_null:
+        action = "SET NOT NULL" if not_null else "DROP NOT NULL"
+        statements.append(f"ALTER DOMAIN {name} {action}")
+    for constraint, check in constraints.items():
+        existing = target_constraints.get(constraint)
+        if existing == check:
+            continue
+        if existing is not None:
+            statements.append(f"ALTER DOMAIN {name} DROP CONSTRAINT {constraint}")
+        statements.append(f"ALTER DOMAIN {name} ADD CONSTRAINT {constraint} {check}")
+    return statements
+
+
+def diff_table(table, source_columns, target_columns):
+    statements = []
+    for column, (
+        type_name,
+        not_null,
+        default,
+        identity,
+        generated,
+    ) in source_columns.items():
+        if column not in target_columns:
+            definition = column_definition(
+                column, type_name, not_null, default, identity, generated
+            )
+            statements.append(f"ALTER TABLE {table} ADD COLUMN {definition}")
+            continue
+
+        target_type, target_not_null, target_default, _, _ = target_columns[column]
+        if type_name != target_type:
+            statements.append(
+                f"ALTER TABLE {table} ALTER COLUMN {column} TYPE {type_name}"
+            )
+        if generated != "s" and identity == "" and default != target_default:
+            if default is None:
+                statements.append(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} DROP DEFAULT"
+                )
+            else:
+                statements.append(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT {default}"
+                )
+        if not_null != target_not_null:
+            action = "SET NOT NULL" if not_null else "DROP NOT NULL"
+            statements.append(f"ALTER TABLE {table} ALTER COLUMN {column} {action}")
+    return statements
+
+
+def create_statements(catalog, kind, name):
+    """The statements creating an object of catalog from scratch."""
+    definition = catalog[kind][name]
+    if kind == "schemas":
+        return [f"CREATE SCHEMA IF NOT EXISTS {name}"]
+    if kind == "extensions":
+        return [f"CREATE EXTENSION IF NOT EXISTS {name} CASCADE"]
+    if kind == "types":
+        return create_type(name, definition)
+    if kind == "sequences":
+        return [f"CREATE SEQUENCE {name} {sequence_options(*definition)}"]
+    if kind == "functions":
+        return [definition]
+    if kind == "tables":
+        columns = ",\n    ".join(
+            column_definition(column, *attributes)
+            for column, attributes in definition.items()
+        )
+        return [f"CREATE TABLE {name} (\n    {columns}\n)"]
+    if kind == "constraints":
+        table, constraint, _, check = definition
+        return [f"ALTER TABLE {table} ADD CONSTRAINT {constraint} {check}"]
+    if kind == "indexes":
+        return [definition]
+    if kind == "triggers":
+        return [definition[2]]
+    if kind == "sequence_owners":
+        return [f"ALTER SEQUENCE {name} OWNED BY {definition}"]
+    relkind, query = definition
+    if relkind == "m":
+        return [f"CREATE MATERIALIZED VIEW {name} AS {query} WITH NO DATA"]
+    return [f"CREATE OR REPLACE VIEW {name} AS {query}"]
+
+
+def change_statements(source, target, kind, name):
+    """The statements converging an object present on both sides."""
+    definition = source[kind][name]
+    existing = target[kind][name]
+    if kind == "types":
+        return diff_type(name, definition, existing)
+    if kind == "sequences":
+        if definition == existing:
+            return []
+        return [f"ALTER SEQUENCE {name} {sequence_options(*definition)}"]
+    if kind == "functions":
+        return [] if definition == existing else [definition]
+    if kind == "tables":
+        return diff_table(name, definition, existing)
+    if kind == "constraints":
+        table, constraint, contype, check = definition
+        if (contype, check) == existing[2:]:
+            return []
+        return [
+            f"ALTER TABLE {table} DROP CONSTRAINT {constraint}",
+            *create_statements(source, kind, name),
+        ]
+    if kind == "indexes":
+        if definition == existing:
+            return []
+        return [f"DROP INDEX {name}", definition]
+    if kind == "views":
+        if definition == existing:
+            return []
+        if definition[0] == "m" or existing[0] == "m":
+            drop = "MATERIALIZED VIEW" if existing[0] == "m" else "VIEW"
+            return [
+                f"DROP {drop} {name} CASCADE",
+                *create_statements(source, kind, name),
+            ]
+        return create_statements(source, kind, name)
+    if kind == "triggers":
+        if definition == existing:
+            return []
+        table, trigger, _ = definition
+        return [
+            f"DROP TRIGGER {trigger} ON {table}",
+            *create_statements(source, kind, name),
+        ]
+    if kind == "sequence_owners":
+        return [] if definition == existing else create_statements(source, kind, name)
+    return []
+
+
+def dependents_of(catalog, key):
+    """Every object of catalog depending on key, directly or not."""
+    dependents = {}
+    for dependent, dependencies in catalog["dependencies"].items():
+        for dependency in dependencies:
+            dependents.setdefault(dependency, set()).add(dependent)
+    found = set()
+    pending = [key]
+    while pending:
+        for dependent in dependents.get(pending.pop(), ()):
+            if dependent not in found:
+                found.add(dependent)
+                pending.append(dependent)
+    return found
+
+
+def dependency_order(changes, dependencies):
+    """
+    Sort the changes so each comes after the changes it depends on, keeping
+    their order otherwise. Dependency cycles are broken in that order.
+    """
+    remaining = {key: dependencies.get(key, set()) & changes.keys() for key in changes}
+    ordered = []
+    while remaining:
+        ready = [key for key, pending in remaining.items() if not pending]
+        if not ready:
+            key = next(iter(remaining))
+            logger.warning(f"Dependency cycle, applying {key[0]} {key[1]} first")
+            ready = [key]
+        for key in ready:
+            del remaining[key]
+            ordered.append(key)
+        for pending in remaining.values():
+            pending.difference_update(ready)
+    return ordered
+
+
+def diff_catalogs(source, target):
+    """
+    Compare two catalogs returned by fetch_catalog and return the changes that
+    converge the target, as (kind, name, statements, dependencies) tuples in
+    dependency order, dependencies only naming earlier changes, along with the names of objects which only exist on the
+    target. Those are reported but never dropped, except views depending on a
+    view which has to be recreated.
+    """
+    changes = {}
+    for kind in KINDS:
+        for name in source[kind]:
+            if name not in target[kind]:
+                statements = create_statements(source, kind, name)
+            else:
+                statements = change_statements(source, target, kind, name)
+            if statements:
+                changes[(kind, name)] = statements
+
+    # Dropping a view drops the views reading from it, and a materialized view
+    # its indexes, recreate those from the source.
+    for kind, name in list(changes):
+        if kind != "views" or not changes[(kind, name)][0].startswith("DROP "):
+            continue
+        dependents = dependents_of(target, (kind, name))
+        for dependent_kind in KINDS:
+            for dependent_name in source[dependent_kind]:
+                if (dependent_kind, dependent_name) in dependents:
+                    changes[(dependent_kind, dependent_name)] = create_statements(
+                        source, dependent_kind, dependent_name
+                    )
+
+    extra = []
+    for kind in KINDS:
+        for name in target[kind]:
+            if name not in source[kind]:
+                extra.append((kind, name))
+            elif kind == "tables":
+                for column in target[kind][name]:
+                    if column not in source[kind][name]:
+                        extra.append(("columns", f"{name}.{column}"))
+
+    # Only dependencies on earlier changes are kept, which drops the edges
+    # dependency_order broke to get out of cycles.
+    dependencies = source["dependencies"]
+    ordered = []
+    earlier = set()
+    for key in dependency_order(changes, dependencies):
+        ordered.append((*key, changes[key], dependencies.get(key, set()) & earlier))
+        earlier.add(key)
+    return ordered, extra
+
+
+def schema_diff(config):
+    with source_db(config) as conn:
+        source = fetch_catalog(conn, configured_schemas(config))
+    with target_db(config) as conn:
+        target = fetch_catalog(conn, configured_schemas(config))
+    return diff_catalogs(source, target)
+
+
+def write_schema_diff(config, file="/tmp/schema_diff.sql"):
+    changes, extra = schema_diff(config)
+    logger.debug(f"Writing schema diff to {file}")
+    with open(file, "w") as f:
+        for kind, name, statements, _ in changes:
+            f.write(f"-- {kind} {name}\n")
+            for statement in statements:
+                f.write(f"{statement};\n")
+        for kind, name in extra:
+            f.write(f"-- only on target, not dropped: {kind} {name}\n")
+
+    for kind, name in extra:
+        logger.warning(f"Only on target, not dropped: {kind} {name}")
+    logger.info(f"{len(changes)} object(s) differ, DDL written to {file}")
+    return changes
+
+
+def apply_change(conn, kind, name, statements):
+    with conn.cursor() as cur:
+        with conn.transaction():
+            for statement in statements:
+                logger.debug(f"Executing query: {statement}")
+                cur.execute(statement)
+
+
+def apply_schema_diff(config, jobs=4):
+    """
+    Apply the changes on the target as soon as the changes they depend on are
+    applied, up to jobs at once, each worker keeping its own connection. Changes
+    depending on a change which failed are skipped.
+    """
+    create_database(config)
+    changes, _ = schema_diff(config)
+    if not changes:
+        logger.info("Target schema matches source, nothing to apply")
+        return []
+
+    order = [(kind, name) for kind, name, _, _ in changes]
+    statements = {(kind, name): s for kind, name, s, _ in changes}
+    dependents = {key: set() for key in order}
+    remaining = {}
+    for kind, name, _, dependencies in changes:
+        remaining[(kind, name)] = len(dependencies)
+        for dependency in dependencies:
+            dependents[dependency].add((kind, name))
+
+    local = threading.local()
+    lock = threading.Lock()
+    failures = []
+    failed = set()
+
+    def apply(key, connections):
+        if not hasattr(local, "conn"):
+            with lock:
+                local.conn = connections.enter_context(target_db(config))
+            local.conn.autocommit = True
+            local.conn.execute("SET check_function_bodies = off")
+        try:
+            apply_change(local.conn, *key, statements[key])
+        except psycopg.errors.DeadlockDetected:
+            # Foreign keys lock both tables, retry once the other side is done.
+            logger.warning(f"Deadlock applying {key[0]} {key[1]}, retrying")
+            apply_change(local.conn, *key, statements[key])
+
+    ready = [key for key in order if remaining[key] == 0]
+    running = {}
+    done = set()
+
+    def release(key):
+        done.add(key)
+        for dependent in sorted(dependents[key], key=order.index):
+            if key in failed:
+                failed.add(dependent)
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+
+    with contextlib.ExitStack() as connections:
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            while len(done) < len(order):
+                while ready:
+                    key = ready.pop(0)
+                    if key in failed:
+                        logger.warning(
+                            f"Skipped {key[0]} {key[1]}, a dependency failed"
+                        )
+                        failures.append((*key, "dependency failed"))
+                        release(key)
+                    else:
+                        running[executor.submit(apply, key, connections)] = key
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key = running.pop(future)
+                    try:
+                        future.result()
+                        logger.info(f"Applied {key[0]} {key[1]}")
+                    except psycopg.Error as e:
+                        logger.error(f"Failed to apply {key[0]} {key[1]}: {e}")
+                        failures.append((*key, str(e)))
+                        failed.add(key)
+                    release(key)
+
+    for key in order:
+        if key not in done:
+            logger.error(f"Never applied {key[0]} {key[1]}, its dependencies were not")
+            failures.append((*key, "dependencies not applied"))
+    if failures:
+        logger.error(f"{len(failures)} schema change(s) failed to apply")
+    else:
+        logger.info(f"Applied {len(changes)} schema change(s)")
+    return failures
@@ -0,0 +1,160 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+import psycopg
+from loguru import logger
+from logrepl.db import target_db
+from logrepl.config import schemas as configured_schemas
+
+
+def view_dependencies(conn):
+    """
+    Return {view: set of views it reads from} for all views and materialized
+    views outside the system schemas, from the dependencies of their rewrite
+    rules. Plain views are kept so materialized views reading each other through
+    them are ordered too.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('v', 'm')
+              AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+            """
+        )
+        graph = {name: set() for (name,) in cur.fetchall()}
+        cur.execute(
+            """
+            SELECT DISTINCT
+                   quote_ident(vn.nspname) || '.' || quote_ident(v.relname),
+                   quote_ident(dn.nspname) || '.' || quote_ident(d.relname)
+            FROM pg_depend dep
+            JOIN pg_rewrite r ON r.oid = dep.objid
+            JOIN pg_class v ON v.oid = r.ev_class
+            JOIN pg_namespace vn ON vn.oid = v.relnamespace
+            JOIN pg_class d ON d.oid = dep.refobjid
+            JOIN pg_namespace dn ON dn.oid = d.relnamespace
+            WHERE dep.classid = 'pg_rewrite'::regclass
+              AND dep.refclassid = 'pg_class'::regclass
+              AND v.relkind IN ('v', 'm')
+              AND d.relkind IN ('v', 'm')
+              AND d.oid <> v.oid
+            """
+        )
+        for view, dependency in cur.fetchall():
+            if view in graph and dependency in graph:
+                graph[view].add(dependency)
+    return graph
+
+
+def materialized_views(conn, schemas):
+    """
+    Return {materialized view: True when it can be refreshed concurrently},
+    which needs it to be populated and to have a valid unique index on plain
+    columns, without a predicate.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+                   c.relispopulated AND EXISTS (
+                       SELECT 1 FROM pg_index i
+                       WHERE i.indrelid = c.oid AND i.indisunique AND i.indpred IS NULL
+                         AND i.indexprs IS NULL AND i.indisvalid
+                   )
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'm' AND n.nspname = ANY(%s)
+            """,
+            [list(schemas)],
+        )
+        return dict(cur.fetchall())
+
+
+def refresh_materialized_view(config, name, concurrently):
+    start = time.monotonic()
+    with target_db(config) as conn:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            if concurrently:
+                cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}")
+            else:
+                cur.execute(f"REFRESH MATERIALIZED VIEW {name}")
+    return time.monotonic() - start
+
+
+def refresh_materialized_views(config, jobs=4):
+    """
+    Refresh the target's materialized views in dependency order, running up to
+    jobs refreshes at once as soon as the views they read from are refreshed.
+    Views depending on a view which failed to refresh are skipped.
+    """
+    with target_db(config) as conn:
+        graph = view_dependencies(conn)
+        matviews = materialized_views(conn, configured_schemas(config))
+
+    dependents = {name: set() for name in graph}
+    for name, dependencies in graph.items():
+        for dependency in dependencies:
+            dependents[dependency].add(name)
+    remaining = {name: len(dependencies) for name, dependencies in graph.items()}
+
+    total = len(matviews)
+    done = 0
+    failed = set()
+    ready = [name for name, count in remaining.items() if count == 0]
+
+    def release(name):
+        for dependent in dependents[name]:
+            if name in failed:
+                failed.add(dependent)
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+
+    logger.info(f"Refreshing {total} materialized view(s) with {jobs} worker(s)")
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = {}
+        while ready or running:
+            while ready:
+                name = ready.pop()
+                if name not in matviews:
+                    # Plain views and views outside the configured schemas.
+                    release(name)
+                elif name in failed:
+                    done += 1
+                    logger.warning(f"[{done}/{total}] Skipped {name}")
+                    release(name)
+                else:
+                    future = executor.submit(
+                        refresh_materialized_view, config, name, matviews[name]
+                    )
+                    running[future] = name
+
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                done += 1
+                try:
+                    elapsed = future.result()
+                    mode = " concurrently" if matviews[name] else ""
+                    logger.info(
+                        f"[{done}/{total}] Refreshed {name}{mode} in {elapsed:.1f}s"
+                    )
+                except psycopg.Error as e:
+                    logger.error(f"[{done}/{total}] Failed to refresh {name}: {e}")
+                    failed.add(name)
+                release(name)
+
+    failed &= set(matviews)
+    logger.info(
+        f"Refreshed {total - len(failed)} materialized view(s) "
+        f"in {time.monotonic() - start:.1f}s"
+    )
+    if failed:
+        logger.error(f"{len(failed)} materialized view(s) failed or were skipped")
+    return not failed
@@ -1,7 +1,10 @@
-from prometheus_client import start_http_server, Gauge, Counter
+from prometheus_client import start_http_server, Gauge, Counter, Histogram
+import contextlib
 import time
 from loguru import logger
-from logrepl.db import source_db
+from logrepl.db import source_db, target_db
+from logrepl.config import replication_groups, schemas
+from logrepl.forecast import LagWindow
 
 
 # To get the replication lag in seconds, we'll need to enable track_commit_timestamp on the source database first
@@ -15,12 +18,113 @@ CONNECTION_ERRORS = Counter(
     "Connection errors",
     ["host", "database", "application_name", "error"],
 )
+CONNECT_TIME = Histogram(
+    "connect_seconds",
+    "Time spent connecting to the polled database",
+    ["host", "database"],
+)
+QUERY_TIME = Histogram(
+    "query_seconds",
+    "Time spent querying the polled database, per metric family",
+    ["host", "database", "metric"],
+)
+LAST_SAMPLE = Gauge(
+    "last_sample_timestamp_seconds",
+    "Unix time of the last successful sample, per metric family",
+    ["metric"],
+)
+SAMPLE_AGE = Gauge(
+    "last_sample_age_seconds",
+    "Seconds since the last successful sample, per metric family",
+    ["metric"],
+)
+POLL_OVERRUNS = Counter(
+    "poll_overruns",
+    "Polls which took longer than the poll interval",
+)
+WAL_RATE = Gauge(
+    "wal_generation_rate_bytes",
+    "WAL generated on the source per second, over the forecast window",
+    ["host", "database", "application_name"],
+)
+APPLY_RATE = Gauge(
+    "replication_apply_rate_bytes",
+    "WAL replayed by the subscriber per second, over the forecast window",
+    ["host", "database", "application_name"],
+)
+CATCHUP_TIME = Gauge(
+    "replication_catchup_seconds",
+    "Forecast seconds until the subscriber has caught up, NaN when diverging",
+    ["host", "database", "application_name"],
+)
+DIVERGING = Gauge(
+    "replication_diverging",
+    "1 when the subscriber is losing ground on the source",
+    ["host", "database", "application_name"],
+)
+PROJECTED_LAG = Gauge(
+    "replication_projected_lag_bytes",
+    "Replication lag in bytes forecast one hour from now",
+    ["host", "database", "application_name"],
+)
+TABLE_CHANGE_RATE = Gauge(
+    "table_change_rate",
+    "Rows changed per second, for the busiest tables on the source",
+    ["side", "database", "table", "operation"],
+)
+TABLE_CHANGE_RATE_DIFFERENCE = Gauge(
+    "table_change_rate_difference",
+    "Source minus target rows changed per second, for the busiest tables",
+    ["database", "table", "operation"],
+)
 POLL_INTERVAL = 10
+# Tables published by the change rate metrics, to keep label cardinality bounded.
+TOP_TABLES = 20
+OPERATIONS = ("insert", "update", "delete")
+# Samples in the forecast window, 5 minutes at the default poll interval.
+FORECAST_WINDOW = 30
+
+# Time of the last successful sample per metric family, read by SAMPLE_AGE at
+# scrape time so the age keeps growing while a poll hangs.
+last_samples = {}
+# Wall clock of the sample timestamps, replaced in tests.
+clock = time.time
+
+
+def track_sample_age(metric):
+    last_samples.setdefault(metric, clock())
+    SAMPLE_AGE.labels(metric=metric).set_function(
+        lambda: clock() - last_samples[metric]
+    )
+
+
+def record_sample(metric):
+    now = clock()
+    last_samples[metric] = now
+    LAST_SAMPLE.labels(metric=metric).set(now)
+
+
+def db_labels(config, side="source"):
+    return {"host": config[side]["host"], "database": config[side]["dbname"]}
+
+
+@contextlib.contextmanager
+def instrumented_db(config, side="source"):
+    connect = source_db if side == "source" else target_db
+    start = time.monotonic()
+    with connect(config) as conn:
+        CONNECT_TIME.labels(**db_labels(config, side)).observe(time.monotonic() - start)
+        yield conn
 
 
 def query_replication_lag(config):
-    with source_db(config) as conn:
-        return get_replication_lag(conn, config["target"]["subscription"])
+    """Return a (subscription, row) tuple per subscription, row is None when absent."""
+    with instrumented_db(config) as conn:
+        with QUERY_TIME.labels(**db_labels(config), metric="replication_lag").time():
+            return [
+                (subscription, get_replication_lag(conn, subscription))
+                for _, subscription, _ in replication_groups(config)
+            ]
 
 
 def get_replication_lag(conn, application_name):
@@ -31,7 +135,9 @@ def get_replication_lag(conn, application_name):
             application_name,
             client_addr,
             state,
-            pg_current_wal_lsn() - replay_lsn AS lag_bytes
+            pg_current_wal_lsn() - replay_lsn AS lag_bytes,
+            pg_current_wal_lsn() - '0/0'::pg_lsn AS wal_bytes,
+            replay_lsn - '0/0'::pg_lsn AS replay_bytes
         FROM
             pg_stat_replication
         WHERE
@@ -43,22 +149,200 @@ def get_replication_lag(conn, application_name):
         return row
 
 
-def metrics_server(config):
-    start_http_server(8000)
-    while True:
-        try:
-            application_name, client_addr, state, lag_bytes = query_replication_lag(
-                config
+def get_table_changes(conn, schemas):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT quote_ident(schemaname) || '.' || quote_ident(relname),
+                   n_tup_ins, n_tup_upd, n_tup_del
+            FROM pg_stat_user_tables
+            WHERE schemaname = ANY(%s)
+            """,
+            [list(schemas)],
+        )
+        return {row[0]: row[1:] for row in cur.fetchall()}
+
+
+def query_table_changes(config, side):
+    with instrumented_db(config, side) as conn:
+        with QUERY_TIME.labels(
+            **db_labels(config, side), metric="table_changes"
+        ).time():
+            return time.monotonic(), get_table_changes(conn, schemas(config))
+
+
+def change_rates(previous, current):
+    """
+    Rows changed per second for each table and operation between two
+    (time, counters) samples. Tables whose counters were reset are left out.
+    """
+    previous_time, previous_counters = previous
+    current_time, current_counters = current
+    elapsed = current_time - previous_time
+    rates = {}
+    if elapsed <= 0:
+        return rates
+    for table, counters in current_counters.items():
+        before = previous_counters.get(table)
+        if before is None:
+            continue
+        deltas = [now - then for now, then in zip(counters, before)]
+        if any(delta < 0 for delta in deltas):
+            continue
+        rates[table] = [delta / elapsed for delta in deltas]
+    return rates
+
+
+def publish_table_changes(config, rates, published, top):
+    """
+    Publish the change rates of the top tables by source change rate, and remove
+    the series of tables which dropped out of the top since the last poll.
+    """
+    source_rates = rates["source"]
+    target_rates = rates["target"]
+    busiest = sorted(source_rates, key=lambda t: sum(source_rates[t]), reverse=True)
+    tables = set(busiest[:top])
+    database = config["source"]["dbname"]
+
+    for table in published - tables:
+        for operation in OPERATIONS:
+            for side in ("source", "target"):
+                try:
+                    TABLE_CHANGE_RATE.remove(side, database, table, operation)
+                except KeyError:
+                    pass
+            try:
+                TABLE_CHANGE_RATE_DIFFERENCE.remove(database, table, operation)
+            except KeyError:
+                pass
+
+    for table in tables:
+        target = target_rates.get(table, [0.0] * len(OPERATIONS))
+        for operation, source_rate, target_rate in zip(
+            OPERATIONS, source_rates[table], target
+        ):
+            TABLE_CHANGE_RATE.labels("source", database, table, operation).set(
+                source_rate
+            )
+            TABLE_CHANGE_RATE.labels("target", database, table, operation).set(
+                target_rate
             )
-            REPLICATION_LAG.labels(
+            TABLE_CHANGE_RATE_DIFFERENCE.labels(database, table, operation).set(
+                source_rate - target_rate
+            )
+    return tables
+
+
+def poll_table_changes(config, state, top):
+    """Sample both databases and publish the change rates, state is kept between polls."""
+    current = {side: query_table_changes(config, side) for side in ("source", "target")}
+    previous = state.get("samples")
+    state["samples"] = current
+    if previous is None:
+        return
+    rates = {
+        side: change_rates(previous[side], current[side])
+        for side in ("source", "target")
+    }
+    state["published"] = publish_table_changes(
+        config, rates, state.get("published", set()), top
+    )
+
+
+def publish_forecast(labels, forecast):
+    WAL_RATE.labels(**labels).set(forecast["wal_rate"])
+    APPLY_RATE.labels(**labels).set(forecast["apply_rate"])
+    CATCHUP_TIME.labels(**labels).set(
+        float("nan")
+        if forecast["catchup_seconds"] is None
+        else forecast["catchup_seconds"]
+    )
+    DIVERGING.labels(**labels).set(1 if forecast["diverging"] else 0)
+    PROJECTED_LAG.labels(**labels).set(forecast["projected_lag"])
+
+
+def remove_subscription_series(config, subscription, windows, published):
+    """Remove the series of a subscription which is no longer connected."""
+    labels = published.pop(subscription, None)
+    if labels is not None:
+        REPLICATION_LAG.remove(*labels)
+    windows.pop(subscription, None)
+    labels = db_labels(config)
+    for gauge in (WAL_RATE, APPLY_RATE, CATCHUP_TIME, DIVERGING, PROJECTED_LAG):
+        try:
+            gauge.remove(labels["host"], labels["database"], subscription)
+        except KeyError:
+            pass
+
+
+def publish_replication_lag(config, rows, windows, published):
+    """
+    Publish the lag and forecast of each connected subscription and return how
+    many were read. published keeps the REPLICATION_LAG label values of each
+    subscription, so series go away when it disconnects or changes state.
+    """
+    read = 0
+    for subscription, row in rows:
+        if row is None:
+            logger.warning(f"No replication connection for {subscription}")
+            CONNECTION_ERRORS.labels(
                 **{
                     "host": config["source"]["host"],
-                    "client": client_addr,
-                    "state": state,
                     "database": config["source"]["dbname"],
-                    "application_name": application_name,
+                    "application_name": subscription,
+                    "error": "not connected",
                 }
-            ).set(lag_bytes)
+            ).inc()
+            remove_subscription_series(config, subscription, windows, published)
+            continue
+        read += 1
+        (
+            application_name,
+            client_addr,
+            state,
+            lag_bytes,
+            wal_bytes,
+            replay_bytes,
+        ) = row
+        labels = (
+            config["source"]["host"],
+            client_addr,
+            state,
+            config["source"]["dbname"],
+            application_name,
+        )
+        previous = published.get(subscription)
+        if previous is not None and previous != labels:
+            REPLICATION_LAG.remove(*previous)
+        published[subscription] = labels
+        REPLICATION_LAG.labels(*labels).set(lag_bytes)
+
+        if replay_bytes is None:
+            continue
+        window = windows.setdefault(subscription, LagWindow(FORECAST_WINDOW))
+        window.add(time.monotonic(), int(wal_bytes), int(replay_bytes))
+        forecast = window.forecast()
+        if forecast is not None:
+            publish_forecast(
+                {**db_labels(config), "application_name": subscription},
+                forecast,
+            )
+    return read
+
+
+def metrics_server(config, top_tables=TOP_TABLES):
+    start_http_server(8000)
+    track_sample_age("replication_lag")
+    track_sample_age("table_changes")
+    windows = {}
+    published = {}
+    table_changes = {}
+    while True:
+        started = time.monotonic()
+        try:
+            rows = query_replication_lag(config)
+            if publish_replication_lag(config, rows, windows, published):
+                record_sample("replication_lag")
         except Exception as e:
             logger.exception("Error querying replication lag")
             CONNECTION_ERRORS.labels(
@@ -69,4 +353,20 @@ def metrics_server(config):
                     "error": str(e),
                 }
             ).inc()
-        time.sleep(POLL_INTERVAL)
+        try:
+            poll_table_changes(config, table_changes, top_tables)
+            record_sample("table_changes")
+        except Exception as e:
+            logger.exception("Error querying table changes")
+            CONNECTION_ERRORS.labels(
+                **{
+                    **db_labels(config),
+                    "application_name": config["target"]["subscription"],
+                    "error": str(e),
+                }
+            ).inc()
+        elapsed = time.monotonic() - started
+        if elapsed > POLL_INTERVAL:
+            logger.warning(f"Poll took {elapsed:.1f}s, longer than {POLL_INTERVAL}s")
+            POLL_OVERRUNS.inc()
+        time.sleep(max(0, POLL_INTERVAL - elapsed))
@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+import re
+import psycopg
+from loguru import logger
+from logrepl.db import source_db, target_db
+
+
+READ_ONLY = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+WRITES = re.compile(
+    r"\b(insert|update|delete|merge|for\s+update|for\s+share|for\s+no\s+key\s+update"
+    r"|for\s+key\s+share|nextval|setval)\b",
+    re.IGNORECASE,
+)
+PARAMETER = re.compile(r"\$\d+")
+INDEX_SCANS = {"Index Scan", "Index Only Scan", "Bitmap Heap Scan"}
+
+
+def top_statements(conn, limit):
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+        if cur.fetchone() is None:
+            raise SystemExit("pg_stat_statements is not installed on source database")
+
+        total_time = (
+            "total_exec_time" if conn.info.server_version >= 130000 else "total_time"
+        )
+        cur.execute(
+            f"""
+            SELECT queryid, query, calls, {total_time}
+            FROM pg_stat_statements
+            WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+            ORDER BY {total_time} DESC
+            LIMIT %s
+            """,
+            [limit],
+        )
+        return cur.fetchall()
+
+
+def is_read_only(query):
+    return bool(READ_ONLY.match(query)) and not WRITES.search(query)
+
+
+def plan_nodes(plan):
+    """Flatten a JSON plan into (node type, relation or index) pairs."""
+    nodes = [(plan["Node Type"], plan.get("Relation Name") or plan.get("Index Name"))]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def scans_by_relation(nodes):
+    scans = {}
+    for node_type, relation in nodes:
+        if node_type == "Seq Scan" or node_type in INDEX_SCANS:
+            scans.setdefault(relation, set()).add(node_type)
+    return scans
+
+
+def explain(conn, query, analyze):
+    options = (
+        "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "GENERIC_PLAN, FORMAT JSON"
+    )
+    with conn.cursor() as cur:
+        # Replays run in a read only transaction which is always rolled back, in
+        # case the read only filter let a write through.
+        cur.execute("SET TRANSACTION READ ONLY")
+        try:
+            cur.execute(f"EXPLAIN ({options}) {query}")
+            result = cur.fetchone()[0][0]
+        finally:
+            conn.rollback()
+    return result
+
+
+def compare_statement(source, target, query, runs):
+    analyze = not PARAMETER.search(query)
+    source_times = []
+    target_times = []
+    for _ in range(runs if analyze else 1):
+        source_plan = explain(source, query, analyze)
+        target_plan = explain(target, query, analyze)
+        if analyze:
+            source_times.append(source_plan["Execution Time"])
+            target_times.append(target_plan["Execution Time"])
+
+    source_nodes = plan_nodes(source_plan["Plan"])
+    target_nodes = plan_nodes(target_plan["Plan"])
+    source_scans = scans_by_relation(source_nodes)
+    target_scans = scans_by_relation(target_nodes)
+    lost_indexes = [
+        relation
+        for relation, scans in target_scans.items()
+        if "Seq Scan" in scans
+        and "Seq Scan" not in source_scans.get(relation, set())
+        and source_scans.get(relation, set()) & INDEX_SCANS
+    ]
+    plan_changed = sorted(map(str, source_nodes)) != sorted(map(str, target_nodes))
+
+    result = {
+        "source_ms": min(source_times) if analyze else None,
+        "target_ms": min(target_times) if analyze else None,
+        "ratio": None,
+        "plan_changed": plan_changed,
+        "lost_indexes": lost_indexes,
+    }
+    if analyze and result["source_ms"] > 0:
+        result["ratio"] = result["target_ms"] / result["source_ms"]
+    return result
+
+
+def compare_statements(config, statements, runs, timeout):
+    results = []
+    with source_db(config) as source, target_db(config) as target:
+        for conn in (source, target):
+            conn.execute("SELECT set_config('statement_timeout', %s, false)", [timeout])
+            conn.commit()
+        for queryid, query, calls, total_time in statements:
+            try:
+                result = compare_statement(source, target, query, runs)
+            except psycopg.Error as e:
+                logger.warning(f"Could not replay statement {queryid}: {e}")
+                result = {"error": str(e)}
+            results.append({"queryid": queryid, "query": query, **result})
+    return results
+
+
+def perfcheck(
+    config, top=20, threshold=1.5, timeout="30s", runs=3, jobs=4, min_compared=0.5
+):
+    """
+    Replay the source's most expensive read only statements on both databases
+    and flag those which are slower on the target by more than threshold, or
+    whose plan swaps an index scan for a sequential scan.
+
+    pg_stat_statements replaces constants with parameters, and statements with
+    parameters cannot be executed: only the statements without any are timed,
+    the others get a generic plan comparison, which requires PostgreSQL 16 on
+    both databases. Exits with an error when less than min_compared of the read
+    only statements could be compared at all.
+    """
+    with source_db(config) as conn:
+        rows = top_statements(conn, top)
+    statements = [row for row in rows if is_read_only(row[1])]
+    logger.info(
+        f"Replaying {len(statements)} read only statement(s), "
+        f"skipping {len(rows) - len(statements)} other(s)"
+    )
+
+    batches = [batch for batch in (statements[i::jobs] for i in range(jobs)) if batch]
+    results = []
+    with ThreadPoolExecutor(max_workers=max(len(batches), 1)) as executor:
+        for batch_results in executor.map(
+            lambda batch: compare_statements(config, batch, runs, timeout), batches
+        ):
+            results.extend(batch_results)
+
+    regressions = []
+    errors = timed = 0
+    for result in results:
+        query = " ".join(result["query"].split())[:80]
+        if "error" in result:
+            errors += 1
+            continue
+        if result["source_ms"] is not None:
+            timed += 1
+        if result["ratio"] is not None:
+            logger.info(
+                f"{result['source_ms']:.2f}ms -> {result['target_ms']:.2f}ms "
+                f"(x{result['ratio']:.2f}) {query}"
+            )
+        elif result["plan_changed"]:
+            logger.info(f"Plan changed {query}")
+        if result["lost_indexes"]:
+            logger.error(
+                f"Sequential scan replaces index scan on "
+                f"{', '.join(result['lost_indexes'])}: {query}"
+            )
+            regressions.append(result)
+        elif result["ratio"] is not None and result["ratio"] > threshold:
+            logger.error(f"Slower on target by x{result['ratio']:.2f}: {query}")
+            regressions.append(result)
+
+    compared = len(results) - errors
+    logger.info(
+        f"Compared {compared} statement(s): {timed} timed, "
+        f"{compared - timed} on their plan only, {errors} failed"
+    )
+    if not compared or compared < min_compared * len(results):
+        raise SystemExit(
+            f"Only {compared} of {len(results)} read only statement(s) could be "
+            "compared, see the errors above"
+        )
+    if regressions:
+        logger.error(f"{len(regressions)} statement(s) regressed on the target")
+    else:
+        logger.info(f"No statement regressed among the {compared} compared")
+    return regressions
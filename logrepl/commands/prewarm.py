@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import psycopg
+from loguru import logger
+from logrepl.db import source_db, target_db
+from logrepl.config import schemas as configured_schemas
+
+
+def has_extension(conn, name):
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = %s", [name])
+        return cur.fetchone() is not None
+
+
+def hot_relations(conn, schemas):
+    """
+    Rank the source's tables and indexes by hotness: the number of their blocks
+    in shared buffers when pg_buffercache is installed, their buffer hits and
+    reads from pg_statio otherwise. Returns (relation, score) tuples.
+    """
+    with conn.cursor() as cur:
+        if has_extension(conn, "pg_buffercache"):
+            logger.debug("Ranking relations with pg_buffercache")
+            cur.execute(
+                """
+                SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+                       count(*) AS buffers
+                FROM pg_buffercache b
+                JOIN pg_class c ON b.relfilenode = pg_relation_filenode(c.oid)
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE b.reldatabase = (
+                          SELECT oid FROM pg_database WHERE datname = current_database()
+                      )
+                  AND c.relkind IN ('r', 'i', 'm')
+                  AND n.nspname = ANY(%s)
+                GROUP BY 1
+                ORDER BY buffers DESC
+                """,
+                [list(schemas)],
+            )
+        else:
+            logger.debug("pg_buffercache is not installed, ranking with pg_statio")
+            cur.execute(
+                """
+                SELECT quote_ident(schemaname) || '.' || quote_ident(relname),
+                       coalesce(heap_blks_hit, 0) + coalesce(heap_blks_read, 0) AS blocks
+                FROM pg_statio_user_tables
+                WHERE schemaname = ANY(%s)
+                UNION ALL
+                SELECT quote_ident(schemaname) || '.' || quote_ident(indexrelname),
+                       coalesce(idx_blks_hit, 0) + coalesce(idx_blks_read, 0)
+                FROM pg_statio_user_indexes
+                WHERE schemaname = ANY(%s)
+                ORDER BY blocks DESC
+                """,
+                [list(schemas), list(schemas)],
+            )
+        return [row for row in cur.fetchall() if row[1] > 0]
+
+
+def prewarm_plan(conn, relations, budget=None):
+    """
+    Pick relations in hotness order until their size on the target fills the
+    budget in bytes, shared_buffers by default. Relations missing on the target
+    are skipped.
+    """
+    with conn.cursor() as cur:
+        if budget is None:
+            cur.execute(
+                "SELECT setting::bigint * current_setting('block_size')::bigint "
+                "FROM pg_settings WHERE name = 'shared_buffers'"
+            )
+            budget = cur.fetchone()[0]
+
+        plan = []
+        total = 0
+        for relation, _ in relations:
+            cur.execute("SELECT pg_relation_size(to_regclass(%s))", [relation])
+            size = cur.fetchone()[0]
+            if size is None:
+                logger.warning(f"{relation} does not exist on target, skipping")
+                continue
+            if total + size > budget:
+                continue
+            plan.append((relation, size))
+            total += size
+    return plan, budget
+
+
+def prewarm_relations(config, relations):
+    loaded = 0
+    with target_db(config) as conn:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for relation, size in relations:
+                start = time.monotonic()
+                try:
+                    cur.execute("SELECT pg_prewarm(%s::regclass)", [relation])
+                except psycopg.Error as e:
+                    logger.error(f"Failed to prewarm {relation}: {e}")
+                    continue
+                blocks = cur.fetchone()[0]
+                loaded += size
+                logger.info(
+                    f"Prewarmed {relation}: {blocks} blocks "
+                    f"in {time.monotonic() - start:.1f}s"
+                )
+    return loaded
+
+
+def prewarm(config, budget=None, jobs=4):
+    """
+    Load the source's hot relations into the target's shared buffers with
+    pg_prewarm. Block numbers do not carry over between the two databases, so
+    relations are loaded whole, hottest first, up to the memory budget in bytes.
+    """
+    with source_db(config) as conn:
+        relations = hot_relations(conn, configured_schemas(config))
+
+    with target_db(config) as conn:
+        with conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+        conn.commit()
+        plan, budget = prewarm_plan(conn, relations, budget)
+
+    logger.info(
+        f"Prewarming {len(plan)} of {len(relations)} hot relation(s), "
+        f"{sum(size for _, size in plan) // 2**20} of {budget // 2**20} MB"
+    )
+    # Round robin keeps the hottest relations at the front of every worker.
+    batches = [batch for batch in (plan[i::jobs] for i in range(jobs)) if batch]
+    loaded = 0
+    with ThreadPoolExecutor(max_workers=max(len(batches), 1)) as executor:
+        for batch_loaded in executor.map(
+            lambda batch: prewarm_relations(config, batch), batches
+        ):
+            loaded += batch_loaded
+    logger.info(f"Prewarmed {loaded // 2**20} MB on target")
+    return loaded
@@ -1,7 +1,13 @@
+import bisect
+import json
+import re
 import subprocess
 import os
+import threading
+import time
 from loguru import logger
 from logrepl.db import target_db
+from logrepl.config import schemas
 from psycopg import sql
 
 
@@ -19,8 +25,13 @@ def create_database(config):
 
 
 def run_subprocess(command, env=None):
-    logger.debug(f"Running command: {command}")
-    subprocess.run(command, shell=True, check=True, env=env)
+    logger.debug(f"Running command: {' '.join(command)}")
+    subprocess.run(command, check=True, env=env)
+
+
+def schema_pattern(schema):
+    """Quote a schema name as a pg_dump pattern, so case and wildcards are literal."""
+    return '"' + schema.replace('"', '""') + '"'
 
 
 def dump_schema(config, file="/tmp/schema.sql"):
@@ -32,11 +43,11 @@ def dump_schema(config, file="/tmp/schema.sql"):
     host = config["source"]["host"]
     port = config["source"]["port"]
     sslmode = config["source"].get("sslmode", "require")
-    schema = "public"
 
-    command = (
-        f"pg_dump -h {host} -p {port} -U {user} -s {dbname} -n {schema} -x -O > {file}"
-    )
+    command = ["pg_dump", "-h", host, "-p", port, "-U", user, "-s", "-x", "-O"]
+    for schema in schemas(config):
+        command += ["-n", schema_pattern(schema)]
+    command += ["-f", file, dbname]
 
     env = os.environ.copy()
     env["PGPASSWORD"] = password
@@ -57,9 +68,192 @@ def restore_schema(config, file="/tmp/schema.sql"):
     port = config["target"]["port"]
     sslmode = config["source"].get("sslmode", "require")
 
-    command = f"psql -h {host} -p {port} -U {user} -d {dbname} -f {file}"
+    command = ["psql", "-h", host, "-p", port, "-U", user, "-d", dbname, "-f", file]
     env = os.environ.copy()
     env["PGPASSWORD"] = password
     env["PGSSLMODE"] = sslmode
 
     run_subprocess(command, env=env)
+
+
+PROGRESS_INTERVAL = 5
+DOLLAR_QUOTE = re.compile(r"\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$")
+PSQL_ERROR = re.compile(r"^psql:[^:]*:(\d+): (?:ERROR|FATAL|PANIC):\s+(.*)$")
+# Failures outside the script, such as a refused connection.
+PSQL_FAILURE = re.compile(r"^psql: (?:error: )?(.*)$")
+
+
+def client_env(conf):
+    env = os.environ.copy()
+    env["PGPASSWORD"] = conf["password"]
+    env["PGSSLMODE"] = conf.get("sslmode", "require")
+    return env
+
+
+def collect_psql_errors(stream, errors, output):
+    """
+    Parse psql's stderr into {"line", "error", "detail"} dicts, line is None for
+    failures outside the script. Every line is also appended to output.
+    """
+    for raw in stream:
+        line = raw.decode("utf-8", "replace").rstrip("\n")
+        output.append(line)
+        match = PSQL_ERROR.match(line)
+        failure = PSQL_FAILURE.match(line)
+        if match:
+            errors.append(
+                {"line": int(match.group(1)), "error": match.group(2), "detail": []}
+            )
+        elif failure:
+            errors.append({"line": None, "error": failure.group(1), "detail": []})
+        elif errors and line and not line.startswith("psql:"):
+            # DETAIL, HINT, CONTEXT and the query excerpt, not later notices.
+            errors[-1]["detail"].append(line)
+        logger.debug(f"psql: {line}")
+
+
+def stream_schema(config, report="/tmp/schema_errors.json"):
+    """
+    Pipe pg_dump straight into psql, without a shell or a staging file, so the
+    restore runs while the dump is still going. The dump is split into
+    statements on the way to report progress and to attach each error psql
+    reports to the statement which caused it. The errors are written to report
+    as JSON and returned.
+    """
+    create_database(config)
+    source = config["source"]
+    target = config["target"]
+
+    dump_command = ["pg_dump", "-h", source["host"], "-p", source["port"]]
+    dump_command += ["-U", source["username"], "-s", "-x", "-O"]
+    for schema in schemas(config):
+        dump_command += ["-n", schema_pattern(schema)]
+    dump_command.append(source["dbname"])
+    restore_command = ["psql", "-X", "-q", "-h", target["host"], "-p", target["port"]]
+    restore_command += ["-U", target["username"], "-d", target["dbname"]]
+    restore_command += ["-v", "ON_ERROR_STOP=0", "-f", "-"]
+
+    logger.debug(f"Running command: {' '.join(dump_command)}")
+    dump = subprocess.Popen(
+        dump_command,
+        env=client_env(source),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    logger.debug(f"Running command: {' '.join(restore_command)}")
+    restore = subprocess.Popen(
+        restore_command,
+        env=client_env(target),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+
+    dump_stderr = []
+    restore_stderr = []
+    errors = []
+    readers = [
+        threading.Thread(target=lambda: dump_stderr.extend(dump.stderr)),
+        threading.Thread(
+            target=collect_psql_errors, args=(restore.stderr, errors, restore_stderr)
+        ),
+    ]
+    for reader in readers:
+        reader.start()
+
+    # (first line, text) of each statement sent, to resolve psql's line numbers.
+    statements = []
+    current = []
+    first_line = None
+    dollar_quote = None
+    sent = 0
+    start = last_progress = time.monotonic()
+    try:
+        for line_number, raw in enumerate(dump.stdout, 1):
+            restore.stdin.write(raw)
+            sent += len(raw)
+
+            line = raw.decode("utf-8", "replace")
+            if not current and (not line.strip() or line.startswith("--")):
+                continue
+            if not current:
+                first_line = line_number
+            current.append(line)
+            for tag in DOLLAR_QUOTE.findall(line):
+                if dollar_quote is None:
+                    dollar_quote = tag
+                elif tag == dollar_quote:
+                    dollar_quote = None
+            if dollar_quote is None and line.rstrip().endswith(";"):
+                statements.append((first_line, "".join(current)))
+                current = []
+
+            if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                elapsed = last_progress - start
+                logger.info(
+                    f"Streamed {sent // 1024} kB at {sent / elapsed / 1024:.0f} kB/s, "
+                    f"{len(statements)} statement(s), {len(errors)} error(s)"
+                )
+        restore.stdin.close()
+    except BrokenPipeError:
+        dump.kill()
+        try:
+            restore.stdin.close()
+        except BrokenPipeError:
+            pass
+        logger.error(
+            f"psql exited with status {restore.wait()} before the end of the dump"
+        )
+
+    dump.wait()
+    restore.wait()
+    for reader in readers:
+        reader.join()
+
+    first_lines = [line for line, _ in statements]
+    for error in errors:
+        index = -1
+        if error["line"] is not None:
+            index = bisect.bisect_right(first_lines, error["line"]) - 1
+        error["statement"] = statements[index][1] if index >= 0 else None
+
+    elapsed = time.monotonic() - start
+    with open(report, "w") as f:
+        json.dump(
+            {
+                "bytes": sent,
+                "seconds": elapsed,
+                "statements": len(statements),
+                "errors": errors,
+                "psql_status": restore.returncode,
+            },
+            f,
+            indent=2,
+        )
+
+    for error in errors:
+        if error["line"] is None:
+            logger.error(f"psql: {error['error']}")
+        else:
+            logger.error(f"Line {error['line']}: {error['error']}")
+
+    # With ON_ERROR_STOP=0 psql only exits non-zero when it could not run the
+    # script at all, psql's failure explains a killed pg_dump.
+    if restore.returncode != 0:
+        raise subprocess.CalledProcessError(
+            restore.returncode,
+            restore_command,
+            stderr="\n".join(restore_stderr),
+        )
+    if dump.returncode != 0:
+        raise subprocess.CalledProcessError(
+            dump.returncode, dump_command, stderr=b"".join(dump_stderr)
+        )
+    logger.info(
+        f"Restored {len(statements)} statement(s), {sent // 1024} kB "
+        f"in {elapsed:.1f}s"
+    )
+    if errors:
+        logger.error(f"{len(errors)} statement(s) failed, see {report}")
+    return errors
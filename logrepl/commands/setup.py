@@ -1,6 +1,8 @@
+import psycopg
 from logrepl.db import execute_sql
 from psycopg import sql
 from loguru import logger
+from logrepl.commands.tune import SYSTEM_PROFILE
 
 
 def create_pglogical_extension(conn):
@@ -26,27 +28,54 @@ def create_replication_set(conn, set_name):
     logger.info(f"Replication set {set_name} created")
 
 
-def add_all_tables_to_replication_set(conn, set_name):
+def add_all_tables_to_replication_set(conn, set_name, schemas=("public",)):
     execute_sql(
         conn,
-        sql.SQL("SELECT pglogical.replication_set_add_all_tables(%s, ARRAY['public'])"),
-        [set_name],
+        sql.SQL("SELECT pglogical.replication_set_add_all_tables(%s, %s)"),
+        [set_name, list(schemas)],
+    )
+    logger.info(
+        f"All tables in {', '.join(schemas)} added to replication set {set_name}"
     )
-    logger.info(f"All tables added to replication set {set_name}")
 
 
-def add_all_sequences_to_replication_set(conn, set_name):
+def add_all_sequences_to_replication_set(conn, set_name, schemas=("public",)):
     execute_sql(
         conn,
-        sql.SQL(
-            "SELECT pglogical.replication_set_add_all_sequences(%s, ARRAY['public'])"
-        ),
-        [set_name],
+        sql.SQL("SELECT pglogical.replication_set_add_all_sequences(%s, %s)"),
+        [set_name, list(schemas)],
     )
-    logger.info(f"All sequences added to replication set {set_name}")
+    logger.info(
+        f"All sequences in {', '.join(schemas)} added to replication set {set_name}"
+    )
+
+
+def grant_tuning(conn, role, parameters):
+    """
+    Grant what the tune command needs: reading where settings come from,
+    reloading the configuration and, from PostgreSQL 15, ALTER SYSTEM on each
+    parameter. Grants which fail are reported and skipped.
+    """
+    grants = [
+        sql.SQL("GRANT pg_read_all_settings TO {}").format(role),
+        sql.SQL("GRANT EXECUTE ON FUNCTION pg_reload_conf() TO {}").format(role),
+    ]
+    if conn.info.server_version >= 150000:
+        grants += [
+            sql.SQL("GRANT ALTER SYSTEM ON PARAMETER {} TO {}").format(
+                sql.SQL(parameter), role
+            )
+            for parameter in parameters
+        ]
+    for grant in grants:
+        try:
+            with conn.transaction():
+                conn.execute(grant)
+        except psycopg.Error as e:
+            logger.warning(f"Could not {grant.as_string(conn)}: {e}")
 
 
-def create_replication_user(conn, user, password):
+def create_replication_user(conn, user, password, schemas=("public",)):
     role = sql.Identifier(user)
 
     with conn.cursor() as cur:
@@ -94,12 +123,24 @@ def create_replication_user(conn, user, password):
             )
         )
 
-        cur.execute(sql.SQL("GRANT ALL ON SCHEMA public TO {}").format(role))
-        cur.execute(sql.SQL("GRANT USAGE ON SCHEMA public TO {}").format(role))
-        cur.execute(
-            sql.SQL(
-                "GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA public TO {}"
-            ).format(role)
-        )
+        for schema in schemas:
+            # Schemas are only granted on once the schema load created them.
+            cur.execute("SELECT 1 FROM pg_namespace WHERE nspname = %s", [schema])
+            if cur.fetchone() is None:
+                logger.warning(
+                    f"Schema {schema} does not exist yet, run replication_user "
+                    "again after loading the schema"
+                )
+                continue
+            schema = sql.Identifier(schema)
+            cur.execute(sql.SQL("GRANT ALL ON SCHEMA {} TO {}").format(schema, role))
+            cur.execute(sql.SQL("GRANT USAGE ON SCHEMA {} TO {}").format(schema, role))
+            cur.execute(
+                sql.SQL(
+                    "GRANT SELECT, INSERT, UPDATE, DELETE ON ALL TABLES IN SCHEMA {} TO {}"
+                ).format(schema, role)
+            )
+
+        grant_tuning(conn, role, SYSTEM_PROFILE)
 
         logger.info(f"Replication user {user} granted permissions")
@@ -10,5 +10,5 @@ def subscription_status(conn, subscription):
         )
         result = cur.fetchone()
         status = result[0]
-        logger.info(f"Subscription status: {status}")
+        logger.info(f"Subscription {subscription} status: {status}")
         return status
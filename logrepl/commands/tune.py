@@ -0,0 +1,247 @@
+import json
+import os
+import psycopg
+from psycopg import sql
+from loguru import logger
+from logrepl.db import replication_target_db
+from logrepl.config import schemas as configured_schemas
+
+
+# Cheaper durability and checkpoints while the target is only a subscriber.
+ROLE_PROFILE = {
+    "synchronous_commit": "off",
+}
+SYSTEM_PROFILE = {
+    "maintenance_work_mem": "1GB",
+    "max_wal_size": "16GB",
+    "checkpoint_timeout": "30min",
+    "pglogical.synchronous_commit": "off",
+    "pglogical.batch_inserts": "on",
+}
+TABLE_PROFILE = {
+    "autovacuum_enabled": "false",
+}
+# The original settings must survive a reboot until stop reverts them.
+TUNE_FILE = os.path.join(
+    os.environ.get("XDG_STATE_HOME", os.path.expanduser("~/.local/state")),
+    "logrepl",
+    "tune.json",
+)
+
+
+def role_settings(conn, role):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT unnest(s.setconfig)
+            FROM pg_db_role_setting s
+            JOIN pg_roles r ON r.oid = s.setrole
+            WHERE r.rolname = %s AND s.setdatabase = 0
+            """,
+            [role],
+        )
+        return dict(row[0].split("=", 1) for row in cur.fetchall())
+
+
+def system_settings(conn, names):
+    """
+    Return the current value of each setting, or None when it is not set with
+    ALTER SYSTEM, in which case reverting resets it. The configuration file a
+    setting comes from is only visible to superusers and pg_read_all_settings,
+    without it a value set by an administrator would be lost on revert.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT name, current_setting(name), source, sourcefile
+            FROM pg_settings
+            WHERE name = ANY(%s)
+            """,
+            [list(names)],
+        )
+        values = {}
+        for name, value, source, sourcefile in cur.fetchall():
+            if source == "configuration file" and sourcefile is None:
+                raise SystemExit(
+                    f"Cannot tell where {name} is set, grant pg_read_all_settings "
+                    "to the replication user"
+                )
+            if (sourcefile or "").endswith("postgresql.auto.conf"):
+                values[name] = value
+        return {name: values.get(name) for name in names}
+
+
+def profile_settings(conn):
+    """Return the settings set with ALTER SYSTEM to their profile value."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT name, current_setting(name), sourcefile
+            FROM pg_settings
+            WHERE name = ANY(%s)
+            """,
+            [list(SYSTEM_PROFILE)],
+        )
+        return [
+            name
+            for name, value, sourcefile in cur.fetchall()
+            if (sourcefile or "").endswith("postgresql.auto.conf")
+            and value == SYSTEM_PROFILE[name]
+        ]
+
+
+def table_settings(conn, schemas, names):
+    """
+    Return the storage parameters of the tables the current user owns, only
+    the owner can change them. Other tables are reported and left alone.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+                   coalesce(c.reloptions, '{}'),
+                   pg_has_role(c.relowner, 'USAGE')
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = ANY(%s) AND c.relkind IN ('r', 'm')
+            """,
+            [list(schemas)],
+        )
+        settings = {}
+        skipped = 0
+        for table, options, owned in cur.fetchall():
+            if not owned:
+                skipped += 1
+                continue
+            options = dict(option.split("=", 1) for option in options)
+            settings[table] = {name: options.get(name) for name in names}
+        if skipped:
+            logger.warning(f"Not the owner of {skipped} table(s), not tuning them")
+        return settings
+
+
+def apply_settings(conn, role, settings):
+    """Apply a {"role": ..., "system": ..., "tables": ...} dict, None resets."""
+    failed = 0
+    statements = []
+    role = sql.Identifier(role)
+    for name, value in settings["role"].items():
+        if value is None:
+            statements.append(
+                sql.SQL("ALTER ROLE {} RESET {}").format(role, sql.SQL(name))
+            )
+        else:
+            statements.append(
+                sql.SQL("ALTER ROLE {} SET {} = {}").format(
+                    role, sql.SQL(name), sql.Literal(value)
+                )
+            )
+    for name, value in settings["system"].items():
+        if value is None:
+            statements.append(sql.SQL("ALTER SYSTEM RESET {}").format(sql.SQL(name)))
+        else:
+            statements.append(
+                sql.SQL("ALTER SYSTEM SET {} = {}").format(
+                    sql.SQL(name), sql.Literal(value)
+                )
+            )
+    # Table names are stored quoted, as returned by table_settings.
+    for table, options in settings["tables"].items():
+        for name, value in options.items():
+            if value is None:
+                statements.append(
+                    sql.SQL("ALTER TABLE {} RESET ({})").format(
+                        sql.SQL(table), sql.SQL(name)
+                    )
+                )
+            else:
+                statements.append(
+                    sql.SQL("ALTER TABLE {} SET ({} = {})").format(
+                        sql.SQL(table), sql.SQL(name), sql.Literal(value)
+                    )
+                )
+
+    with conn.cursor() as cur:
+        for statement in statements:
+            try:
+                logger.debug(f"Executing query: {statement.as_string(conn)}")
+                cur.execute(statement)
+            except psycopg.Error as e:
+                logger.error(f"Failed: {statement.as_string(conn)}: {e}")
+                failed += 1
+        if settings["system"]:
+            try:
+                cur.execute("SELECT pg_reload_conf()")
+            except psycopg.Error as e:
+                logger.error(f"Failed to reload the configuration: {e}")
+                failed += 1
+    return failed
+
+
+def tune(config, file=TUNE_FILE):
+    """
+    Record the target settings in the migration profile to file, then apply the
+    profile. When file already exists the settings are already tuned and the
+    recorded originals are kept.
+    """
+    role = config["target"]["replication_username"]
+    with replication_target_db(config) as conn:
+        conn.autocommit = True
+        if os.path.exists(file):
+            logger.warning(f"Keeping the original settings already saved in {file}")
+        else:
+            original = {
+                "role": {
+                    name: role_settings(conn, role).get(name) for name in ROLE_PROFILE
+                },
+                "system": system_settings(conn, SYSTEM_PROFILE),
+                "tables": table_settings(
+                    conn, configured_schemas(config), TABLE_PROFILE
+                ),
+            }
+            os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+            with open(file, "w") as f:
+                json.dump(original, f, indent=2)
+            logger.info(f"Original settings saved to {file}")
+
+        with open(file) as f:
+            tables = json.load(f)["tables"]
+        failed = apply_settings(
+            conn,
+            role,
+            {
+                "role": ROLE_PROFILE,
+                "system": SYSTEM_PROFILE,
+                "tables": {table: TABLE_PROFILE for table in tables},
+            },
+        )
+    if failed:
+        logger.error(f"{failed} setting(s) could not be applied")
+    else:
+        logger.info("Migration profile applied on target")
+
+
+def revert_tuning(config, file=TUNE_FILE):
+    if not os.path.exists(file):
+        logger.info(f"No original settings saved in {file}, nothing to revert")
+        with replication_target_db(config) as conn:
+            tuned = profile_settings(conn)
+        if tuned:
+            logger.warning(
+                f"The target still has {', '.join(tuned)} from the migration "
+                "profile in postgresql.auto.conf, revert with the file tune saved"
+            )
+        return
+    with open(file) as f:
+        original = json.load(f)
+
+    with replication_target_db(config) as conn:
+        conn.autocommit = True
+        failed = apply_settings(
+            conn, config["target"]["replication_username"], original
+        )
+    if failed:
+        logger.error(f"{failed} setting(s) could not be reverted, keeping {file}")
+        return
+    os.remove(file)
+    logger.info("Original settings restored on target")
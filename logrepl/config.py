@@ -16,6 +16,8 @@ class SourceConfig(TypedDict):
         Literal["verify-ca"],
         Literal["verify-full"],
     ]
+    # Comma separated schemas, "public" by default. Separate groups of schemas
+    # with ";" to give each group its own replication set and subscription.
     schema: Optional[str]
 
     node: str
@@ -65,3 +67,39 @@ def load_config_from_env():
         if "port" not in config[section]:
             config[section]["port"] = "5432"
     return config
+
+
+def schema_groups(config):
+    """
+    Parse the schema setting into groups of schema names, for example
+    "public; sales, billing" gives [["public"], ["sales", "billing"]]. The source
+    setting takes precedence over the target one.
+    """
+    value = config["source"].get("schema") or config["target"].get("schema") or "public"
+    groups = []
+    for group in value.split(";"):
+        schemas = [schema.strip() for schema in group.split(",") if schema.strip()]
+        if schemas:
+            groups.append(schemas)
+    return groups
+
+
+def schemas(config):
+    return [schema for group in schema_groups(config) for schema in group]
+
+
+def replication_groups(config):
+    """
+    Return a (replication set, subscription, schemas) tuple per schema group.
+    A single group uses the configured names, several groups are suffixed with
+    the name of their first schema so each gets its own apply worker.
+    """
+    set_name = config["source"]["replication_set"]
+    subscription = config["target"]["subscription"]
+    groups = schema_groups(config)
+    if len(groups) == 1:
+        return [(set_name, subscription, groups[0])]
+    return [
+        (f"{set_name}_{group[0]}", f"{subscription}_{group[0]}", group)
+        for group in groups
+    ]
@@ -41,6 +41,20 @@ def target_db(config, dbname=None):
         yield conn
 
 
+@contextlib.contextmanager
+def replication_target_db(config, dbname=None):
+    conf = config["target"]
+    with connect_db(
+        dbname or conf["dbname"],
+        conf["replication_username"],
+        conf["replication_password"],
+        conf["host"],
+        conf["port"],
+        conf["sslmode"],
+    ) as conn:
+        yield conn
+
+
 def execute_sql(conn, query, args=None):
     args = args or []
     logger.debug(f"Executing query: {query} with args: {args}")
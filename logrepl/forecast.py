@@ -0,0 +1,52 @@
+import collections
+
+
+class LagWindow:
+    """
+    Sliding window of replication position samples, kept in a fixed size ring
+    buffer so memory stays constant however long the exporter runs.
+    """
+
+    def __init__(self, size):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, timestamp, wal_bytes, replay_bytes):
+        self.samples.append((timestamp, wal_bytes, replay_bytes))
+
+    def forecast(self, horizon=3600):
+        """
+        Compare the WAL generation rate on the source with the apply rate of the
+        subscriber over the window, in bytes per second. When the subscriber is
+        gaining ground, catchup_seconds estimates when the lag reaches zero;
+        otherwise it is None and diverging is set when there is lag to lose.
+        projected_lag is the lag in bytes expected horizon seconds from now.
+        Returns None until the window holds two samples.
+        """
+        if len(self.samples) < 2:
+            return None
+        first_time, first_wal, first_replay = self.samples[0]
+        last_time, last_wal, last_replay = self.samples[-1]
+        elapsed = last_time - first_time
+        if elapsed <= 0:
+            return None
+
+        lag = max(last_wal - last_replay, 0)
+        wal_rate = (last_wal - first_wal) / elapsed
+        apply_rate = (last_replay - first_replay) / elapsed
+        gain = apply_rate - wal_rate
+
+        if lag == 0:
+            catchup_seconds = 0.0
+        elif gain > 0:
+            catchup_seconds = lag / gain
+        else:
+            catchup_seconds = None
+
+        return {
+            "lag": lag,
+            "wal_rate": wal_rate,
+            "apply_rate": apply_rate,
+            "catchup_seconds": catchup_seconds,
+            "diverging": lag > 0 and gain <= 0,
+            "projected_lag": max(lag - gain * horizon, 0),
+        }
@@ -1,15 +1,28 @@
 import psycopg
 import argparse
 from pprint import pprint
-from .config import load_config_from_ini, load_config_from_env
+from .config import (
+    load_config_from_ini,
+    load_config_from_env,
+    replication_groups,
+    schemas,
+)
 import io
+import time
 from loguru import logger
 from psycopg import sql
 from .db import source_db, target_db, execute_sql, source_dsn, target_dsn
-from .commands.metrics import metrics_server
+from .commands.metrics import metrics_server, get_replication_lag
+from .forecast import LagWindow
 from .commands.verify import verify_config
-from .commands.schema import dump_schema, restore_schema
+from .commands.schema import dump_schema, restore_schema, stream_schema
+from .commands.diff import write_schema_diff, apply_schema_diff
 from .commands.client import handle_client
+from .commands.perfcheck import perfcheck
+from .commands.prewarm import prewarm
+from .commands.tune import tune, revert_tuning, TUNE_FILE
+from .commands.largeobjects import sync_large_objects
+from .commands.matviews import refresh_materialized_views
 from .commands.setup import (
     create_pglogical_extension,
     create_node,
@@ -24,9 +37,48 @@ from .commands.teardown import drop_node, drop_replication_set, drop_subscriptio
 
 
 # -- commands --
-def status(config):
+def status(config, samples=0, interval=5):
     with target_db(config) as conn:
-        subscription_status(conn, config["target"]["subscription"])
+        for _, subscription, _ in replication_groups(config):
+            subscription_status(conn, subscription)
+    if samples > 1:
+        forecast_lag(config, samples, interval)
+
+
+def forecast_lag(config, samples, interval):
+    subscriptions = [subscription for _, subscription, _ in replication_groups(config)]
+    windows = {subscription: LagWindow(samples) for subscription in subscriptions}
+    logger.info(f"Sampling replication lag {samples} times, every {interval}s")
+    with source_db(config) as conn:
+        for i in range(samples):
+            for subscription in subscriptions:
+                row = get_replication_lag(conn, subscription)
+                conn.commit()
+                if row is not None and row[5] is not None:
+                    windows[subscription].add(
+                        time.monotonic(), int(row[4]), int(row[5])
+                    )
+            if i < samples - 1:
+                time.sleep(interval)
+
+    for subscription, window in windows.items():
+        forecast = window.forecast()
+        if forecast is None:
+            logger.warning(f"Not enough samples to forecast {subscription}")
+            continue
+        rates = (
+            f"lag {forecast['lag']} bytes, WAL {forecast['wal_rate']:.0f} B/s, "
+            f"apply {forecast['apply_rate']:.0f} B/s"
+        )
+        if forecast["diverging"]:
+            logger.warning(
+                f"{subscription} is diverging: {rates}, "
+                f"projected lag in one hour {forecast['projected_lag']:.0f} bytes"
+            )
+        else:
+            logger.info(
+                f"{subscription} catches up in {forecast['catchup_seconds']:.0f}s: {rates}"
+            )
 
 
 def setup(config):
@@ -34,7 +86,7 @@ def setup(config):
     create_schema(config)  # from source to target
     create_provider_node(config)  # on source database
 
-    # Add all tables in public schema to the default replication set on the source databases
+    # Add all tables in the configured schemas to their replication set on the source database
     init_replication_set(config)
     create_subscriber(config)
     create_subscription(config)
@@ -56,15 +108,19 @@ def get_sequence_names(config, schema="public"):
 
 
 def synchronize_sequences(config):
-    schema = "public"
-    sequences = get_sequence_names(config, schema)
-    with source_db(config) as conn:
-        with conn.cursor() as cur:
-            for sequence in sequences:
-                cur.execute(
-                    "SELECT pglogical.synchronize_sequence(%s)",
-                    [f"{schema}.{sequence}"],
-                )
+    for schema in schemas(config):
+        sequences = get_sequence_names(config, schema)
+        with source_db(config) as conn:
+            with conn.cursor() as cur:
+                for sequence in sequences:
+                    cur.execute(
+                        "SELECT pglogical.synchronize_sequence(%s)",
+                        [
+                            sql.SQL("{}.{}")
+                            .format(sql.Identifier(schema), sql.Identifier(sequence))
+                            .as_string(conn)
+                        ],
+                    )
 
 
 def create_subscriber(config):
@@ -86,32 +142,33 @@ def setup_replication_user(config):
             conn,
             config["target"]["replication_username"],
             config["target"]["replication_password"],
+            schemas(config),
         )
 
 
 def create_subscription(config):
-    subscription = config["target"]["subscription"]
-    set_name = config["source"]["replication_set"]
     dsn = source_dsn(config)
     with target_db(config) as conn:
-        execute_sql(
-            conn,
-            sql.SQL(
-                "SELECT pglogical.create_subscription(subscription_name := %s, provider_dsn := %s, replication_sets := ARRAY[%s])"
-            ),
-            [subscription, dsn, set_name],
-        )
-        logger.info(
-            f"Subscription {subscription} to replication set {set_name} created"
-        )
+        # Each subscription has its own apply worker, so schema groups sync in parallel.
+        for set_name, subscription, _ in replication_groups(config):
+            execute_sql(
+                conn,
+                sql.SQL(
+                    "SELECT pglogical.create_subscription(subscription_name := %s, provider_dsn := %s, replication_sets := ARRAY[%s])"
+                ),
+                [subscription, dsn, set_name],
+            )
+            logger.info(
+                f"Subscription {subscription} to replication set {set_name} created"
+            )
 
 
 def init_replication_set(config):
-    set_name = config["source"]["replication_set"]
     with source_db(config) as conn:
-        create_replication_set(conn, set_name)
-        add_all_tables_to_replication_set(conn, set_name)
-        add_all_sequences_to_replication_set(conn, set_name)
+        for set_name, _, group in replication_groups(config):
+            create_replication_set(conn, set_name)
+            add_all_tables_to_replication_set(conn, set_name, group)
+            add_all_sequences_to_replication_set(conn, set_name, group)
 
 
 def create_provider_node(config):
@@ -124,9 +181,9 @@ def drop_provider_node(config):
         drop_node(conn, config["source"]["node"])
 
 
-def create_schema(config):
-    dump_schema(config)
-    restore_schema(config)
+def create_schema(config, file="/tmp/schema.sql"):
+    dump_schema(config, file)
+    restore_schema(config, file)
 
 
 def teardown_database(config):
@@ -142,12 +199,14 @@ def teardown_database(config):
 
 def teardown_replication_set(config):
     with source_db(config) as conn:
-        drop_replication_set(conn, config["source"]["replication_set"])
+        for set_name, _, _ in replication_groups(config):
+            drop_replication_set(conn, set_name)
 
 
 def teardown_subscription(config):
     with target_db(config) as conn:
-        drop_subscription(conn, config["target"]["subscription"])
+        for _, subscription, _ in replication_groups(config):
+            drop_subscription(conn, subscription)
 
 
 def teardown_subscriber(config):
@@ -168,9 +227,10 @@ def create_extension(config):
         create_pglogical_extension(conn)
 
 
-def stop(config):
-    with target_db(config) as conn:
-        drop_subscription(conn, config["target"]["subscription"])
+def stop(config, tune_file=TUNE_FILE):
+    teardown_subscription(config)
+    # The target is about to take over, restore the settings the tune command changed.
+    revert_tuning(config, tune_file)
 
 
 def teardown_all(config):
@@ -234,12 +294,48 @@ def argparser():
         action="store_true",
         help="Load the schema on target database",
     )
+    schema_parser.add_argument(
+        "--stream",
+        "-s",
+        required=False,
+        action="store_true",
+        help="Pipe the dump straight into the restore, without a file",
+    )
+    schema_parser.add_argument(
+        "--report",
+        "-r",
+        required=False,
+        help="Path to the JSON error report of --stream",
+        default="/tmp/schema_errors.json",
+    )
     setup_subparsers.add_parser("provider", help="Create the provider node")
     setup_subparsers.add_parser("replication_set", help="Create the replication set")
     setup_subparsers.add_parser("subscriber", help="Create the subscriber")
     setup_subparsers.add_parser("subscription", help="Create the subscriber")
     setup_subparsers.add_parser("replication_user", help="Create the replication user")
     setup_subparsers.add_parser("sequences", help="Copy sequence values")
+    largeobjects_parser = setup_subparsers.add_parser(
+        "largeobjects", help="Copy large objects, which pglogical does not replicate"
+    )
+    largeobjects_parser.add_argument(
+        "--jobs",
+        "-j",
+        required=False,
+        type=int,
+        help="Number of workers, each with a connection to both databases",
+        default=4,
+    )
+    matviews_parser = setup_subparsers.add_parser(
+        "matviews", help="Refresh the materialized views on the target"
+    )
+    matviews_parser.add_argument(
+        "--jobs",
+        "-j",
+        required=False,
+        type=int,
+        help="Number of materialized views refreshed at once",
+        default=4,
+    )
 
     teardown_subparser = subparsers.add_parser(
         "teardown", help="Teardown the replication"
@@ -255,14 +351,156 @@ def argparser():
     teardown_subparsers.add_parser("subscription", help="Drop the subscription")
     teardown_subparsers.add_parser("all", help="Teardown the replication")
 
-    subparsers.add_parser("status", help="Show the status of the replication")
-    subparsers.add_parser("stop", help="Stop the replication")
+    schema_subparser = subparsers.add_parser(
+        "schema", help="Compare and converge the target schema"
+    )
+    schema_subparsers = schema_subparser.add_subparsers(dest="schema_command")
+    diff_parser = schema_subparsers.add_parser(
+        "diff", help="Write the DDL needed to converge the target schema"
+    )
+    diff_parser.add_argument(
+        "--file",
+        "-f",
+        required=False,
+        help="Path to the schema diff file",
+        default="/tmp/schema_diff.sql",
+    )
+    apply_parser = schema_subparsers.add_parser(
+        "apply", help="Apply the schema diff on the target database"
+    )
+    apply_parser.add_argument(
+        "--jobs",
+        "-j",
+        required=False,
+        type=int,
+        help="Number of target connections used for independent objects",
+        default=4,
+    )
+
+    status_parser = subparsers.add_parser(
+        "status", help="Show the status of the replication"
+    )
+    status_parser.add_argument(
+        "--forecast",
+        required=False,
+        type=int,
+        metavar="SAMPLES",
+        help="Sample the replication lag and forecast the catch-up time",
+        default=0,
+    )
+    status_parser.add_argument(
+        "--interval",
+        required=False,
+        type=float,
+        help="Seconds between forecast samples",
+        default=5,
+    )
+    stop_parser = subparsers.add_parser("stop", help="Stop the replication")
+    stop_parser.add_argument(
+        "--file",
+        "-f",
+        required=False,
+        help="Path to the original settings file saved by tune",
+        default=TUNE_FILE,
+    )
     subparsers.add_parser("verify", help="Verify the configuration")
     client = subparsers.add_parser("client", help="Connect with psql")
     client.add_argument(
         "--database", "-d", required=False, help="Database: source or target"
     )
-    subparsers.add_parser("metrics", help="Start the prometheus metrics server")
+    metrics_parser = subparsers.add_parser(
+        "metrics", help="Start the prometheus metrics server"
+    )
+    metrics_parser.add_argument(
+        "--top-tables",
+        required=False,
+        type=int,
+        help="Number of busiest tables to publish change rates for",
+        default=20,
+    )
+    perfcheck_parser = subparsers.add_parser(
+        "perfcheck",
+        help="Compare the top pg_stat_statements queries on source and target",
+    )
+    perfcheck_parser.add_argument(
+        "--top",
+        "-n",
+        required=False,
+        type=int,
+        help="Number of statements to compare, by total time",
+        default=20,
+    )
+    perfcheck_parser.add_argument(
+        "--threshold",
+        required=False,
+        type=float,
+        help="Flag statements slower on the target by more than this ratio",
+        default=1.5,
+    )
+    perfcheck_parser.add_argument(
+        "--timeout",
+        required=False,
+        help="Statement timeout for each replay",
+        default="30s",
+    )
+    perfcheck_parser.add_argument(
+        "--runs",
+        required=False,
+        type=int,
+        help="Replays per statement, the fastest is kept",
+        default=3,
+    )
+    perfcheck_parser.add_argument(
+        "--jobs",
+        "-j",
+        required=False,
+        type=int,
+        help="Number of connections to each database",
+        default=4,
+    )
+    perfcheck_parser.add_argument(
+        "--min-compared",
+        required=False,
+        type=float,
+        help="Fail when less than this fraction of the statements can be compared",
+        default=0.5,
+    )
+
+    prewarm_parser = subparsers.add_parser(
+        "prewarm", help="Load the source's hot relations in the target's cache"
+    )
+    prewarm_parser.add_argument(
+        "--budget",
+        "-b",
+        required=False,
+        type=int,
+        help="Memory budget in MB, defaults to the target's shared_buffers",
+    )
+    prewarm_parser.add_argument(
+        "--jobs",
+        "-j",
+        required=False,
+        type=int,
+        help="Number of target connections",
+        default=4,
+    )
+    tune_parser = subparsers.add_parser(
+        "tune", help="Apply the migration settings profile on the target"
+    )
+    tune_parser.add_argument(
+        "--revert",
+        "-r",
+        required=False,
+        action="store_true",
+        help="Restore the original target settings",
+    )
+    tune_parser.add_argument(
+        "--file",
+        "-f",
+        required=False,
+        help="Path to the original settings file",
+        default=TUNE_FILE,
+    )
 
     return parser
 
@@ -273,7 +511,9 @@ def handle_setup(config, args):
     elif args.setup_command == "extension":
         create_extension(config)
     elif args.setup_command == "schema":
-        if args.dump:
+        if args.stream:
+            stream_schema(config, args.report)
+        elif args.dump:
             dump_schema(config, args.file)
         elif args.load:
             restore_schema(config, args.file)
@@ -289,6 +529,10 @@ def handle_setup(config, args):
         setup_replication_user(config)
     elif args.setup_command == "sequences":
         synchronize_sequences(config)
+    elif args.setup_command == "largeobjects":
+        sync_large_objects(config, args.jobs)
+    elif args.setup_command == "matviews":
+        refresh_materialized_views(config, args.jobs)
     elif args.setup_command == "pgbench":
         init_pgbench(config)
 
@@ -308,6 +552,13 @@ def handle_teardown(config, args):
         teardown_subscription(config)
 
 
+def handle_schema(config, args):
+    if args.schema_command == "diff":
+        write_schema_diff(config, args.file)
+    elif args.schema_command == "apply":
+        apply_schema_diff(config, args.jobs)
+
+
 def main():
     parser = argparser()
     args = parser.parse_args()
@@ -324,13 +575,15 @@ def main():
     elif args.command == "load":
         restore_schema(config)
     elif args.command == "status":
-        status(config)
+        status(config, args.forecast, args.interval)
     elif args.command == "setup":
         handle_setup(config, args)
     elif args.command == "stop":
-        stop(config)
+        stop(config, args.file)
     elif args.command == "teardown":
         handle_teardown(config, args)
+    elif args.command == "schema":
+        handle_schema(config, args)
     elif args.command == "config":
         dump_config(config)
     elif args.command == "verify":
@@ -338,7 +591,27 @@ def main():
     elif args.command == "client":
         handle_client(config, args)
     elif args.command == "metrics":
-        metrics_server(config)
+        metrics_server(config, args.top_tables)
+    elif args.command == "perfcheck":
+        regressions = perfcheck(
+            config,
+            args.top,
+            args.threshold,
+            args.timeout,
+            args.runs,
+            args.jobs,
+            args.min_compared,
+        )
+        if regressions:
+            raise SystemExit(1)
+    elif args.command == "prewarm":
+        budget = args.budget * 2**20 if args.budget else None
+        prewarm(config, budget, args.jobs)
+    elif args.command == "tune":
+        if args.revert:
+            revert_tuning(config, args.file)
+        else:
+            tune(config, args.file)
     else:
         print("Unknown command")
         parser.print_help()
@@ -0,0 +1,287 @@
+"""
+Throwaway PostgreSQL clusters for the integration and benchmark suites.
+
+Two clusters, a source and a target, are created with initdb in temporary
+directories and started with pg_ctl on free local ports. pglogical is added to
+shared_preload_libraries when it is installed, tests that need it are skipped
+otherwise. No network access or Docker is needed, only the PostgreSQL server
+binaries (found on PATH, with pg_config, or with LOGREPL_PG_BINDIR).
+"""
+
+import contextlib
+import itertools
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import time
+
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+
+# Timings only compare on the machine which recorded them, so baselines are kept
+# outside the tree.
+BASELINES = os.environ.get(
+    "LOGREPL_BENCHMARK_BASELINES",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "logrepl",
+        "baselines.json",
+    ),
+)
+UPDATE_BASELINES = os.environ.get("LOGREPL_UPDATE_BASELINES") == "1"
+# A benchmark fails when its median is slower than the baseline by this factor,
+# the absolute slack keeps sub-millisecond timings from flapping.
+REGRESSION_FACTOR = float(os.environ.get("LOGREPL_BENCHMARK_FACTOR", "1.5"))
+REGRESSION_SLACK = 0.005
+
+_database_ids = itertools.count()
+
+
+def find_bindir():
+    bindir = os.environ.get("LOGREPL_PG_BINDIR")
+    if bindir:
+        return bindir
+    initdb = shutil.which("initdb")
+    if initdb:
+        return os.path.dirname(initdb)
+    pg_config = shutil.which("pg_config")
+    if pg_config:
+        return subprocess.run(
+            [pg_config, "--bindir"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    return None
+
+
+def pglogical_available(bindir):
+    pg_config = os.path.join(bindir, "pg_config")
+    if not os.path.exists(pg_config):
+        pg_config = shutil.which("pg_config")
+    if not pg_config:
+        return False
+    pkglibdir = subprocess.run(
+        [pg_config, "--pkglibdir"], capture_output=True, text=True, check=True
+    ).stdout.strip()
+    return os.path.exists(os.path.join(pkglibdir, "pglogical.so"))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+class Cluster:
+    def __init__(self, bindir, directory, preload_pglogical):
+        self.bindir = bindir
+        self.datadir = os.path.join(directory, "data")
+        self.logfile = os.path.join(directory, "postgresql.log")
+        self.port = free_port()
+        self.preload_pglogical = preload_pglogical
+
+    def run(self, binary, *args):
+        subprocess.run(
+            [os.path.join(self.bindir, binary), *args],
+            check=True,
+            capture_output=True,
+        )
+
+    def start(self):
+        self.run(
+            "initdb", "-D", self.datadir, "-U", "postgres", "-A", "trust", "-E", "UTF8"
+        )
+        options = [
+            f"-p {self.port}",
+            "-c listen_addresses=localhost",
+            f"-c unix_socket_directories={os.path.dirname(self.datadir)}",
+            "-c wal_level=logical",
+            "-c max_worker_processes=10",
+            "-c max_replication_slots=10",
+            "-c max_wal_senders=10",
+            "-c fsync=off",
+        ]
+        if self.preload_pglogical:
+            options.append("-c shared_preload_libraries=pglogical")
+            options.append("-c track_commit_timestamp=on")
+        self.run(
+            "pg_ctl",
+            "-D",
+            self.datadir,
+            "-l",
+            self.logfile,
+            "-w",
+            "-o",
+            " ".join(options),
+            "start",
+        )
+
+    def stop(self):
+        self.run("pg_ctl", "-D", self.datadir, "-m", "immediate", "-w", "stop")
+
+    def settings(self, dbname):
+        return {
+            "host": "localhost",
+            "port": str(self.port),
+            "username": "postgres",
+            "password": "",
+            "dbname": dbname,
+            "sslmode": "disable",
+        }
+
+    @contextlib.contextmanager
+    def connect(self, dbname="postgres"):
+        with psycopg.connect(
+            host="localhost",
+            port=self.port,
+            user="postgres",
+            dbname=dbname,
+            autocommit=True,
+        ) as conn:
+            yield conn
+
+
+@pytest.fixture(scope="session")
+def bindir():
+    bindir = find_bindir()
+    if bindir is None or not os.path.exists(os.path.join(bindir, "initdb")):
+        pytest.skip("PostgreSQL server binaries not found")
+    # dump_schema, restore_schema and pgbench shell out to the client binaries.
+    os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+    return bindir
+
+
+@pytest.fixture(scope="session")
+def has_pglogical(bindir):
+    return pglogical_available(bindir)
+
+
+@pytest.fixture(scope="session")
+def clusters(bindir, has_pglogical, tmp_path_factory):
+    source = Cluster(bindir, tmp_path_factory.mktemp("source"), has_pglogical)
+    target = Cluster(bindir, tmp_path_factory.mktemp("target"), has_pglogical)
+    source.start()
+    try:
+        target.start()
+        try:
+            yield source, target
+        finally:
+            target.stop()
+    finally:
+        source.stop()
+
+
+@pytest.fixture
+def requires_pglogical(has_pglogical):
+    if not has_pglogical:
+        pytest.skip("pglogical is not installed")
+
+
+@pytest.fixture
+def config(clusters):
+    """
+    A logrepl configuration pointing at a fresh database on the source. The
+    target database of the same name is left for restore_schema to create.
+    """
+    source, target = clusters
+    dbname = f"logrepl_{os.getpid()}_{next(_database_ids)}"
+    with source.connect() as conn:
+        conn.execute(f"CREATE DATABASE {dbname}")
+
+    config = {
+        "source": {
+            **source.settings(dbname),
+            "node": f"{dbname}_provider",
+            "replication_set": dbname,
+        },
+        "target": {
+            **target.settings(dbname),
+            "node": f"{dbname}_subscriber",
+            "subscription": f"{dbname}_subscription",
+            "replication_username": "replicator",
+            "replication_password": "replicator",
+        },
+    }
+    yield config
+
+    with target.connect() as conn:
+        conn.execute(f"DROP DATABASE IF EXISTS {dbname} WITH (FORCE)")
+    with source.connect() as conn:
+        conn.execute(
+            "SELECT pg_drop_replication_slot(slot_name) FROM pg_replication_slots "
+            "WHERE database = %s AND NOT active",
+            [dbname],
+        )
+        conn.execute(f"DROP DATABASE IF EXISTS {dbname} WITH (FORCE)")
+
+
+def wait_for(predicate, timeout=60, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    raise TimeoutError(f"Timed out after {timeout}s waiting for {predicate.__name__}")
+
+
+@pytest.fixture(scope="session")
+def baselines():
+    """
+    Benchmark baselines loaded from BASELINES. Timings are only recorded when
+    LOGREPL_UPDATE_BASELINES=1, benchmarks without a baseline are skipped.
+    """
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as f:
+            data = json.load(f)
+    else:
+        data = {}
+    results = {}
+    yield data, results
+
+    if UPDATE_BASELINES and results:
+        data.update(results)
+        os.makedirs(os.path.dirname(BASELINES), exist_ok=True)
+        with open(BASELINES, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+@pytest.fixture
+def benchmark(baselines, request):
+    """
+    Time a callable and compare the median against the stored baseline:
+
+        benchmark(verify_config, config, rounds=5)
+
+    Each round may be prepared by an optional setup callable which is not timed.
+    """
+    data, results = baselines
+
+    def run(func, *args, rounds=5, setup=None, name=None):
+        name = name or request.node.name
+        baseline = data.get(name)
+        if baseline is None and not UPDATE_BASELINES:
+            pytest.skip(
+                f"No baseline for {name}, record with LOGREPL_UPDATE_BASELINES=1"
+            )
+        timings = []
+        result = None
+        for _ in range(rounds):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            result = func(*args)
+            timings.append(time.perf_counter() - start)
+        median = statistics.median(timings)
+        results[name] = median
+
+        if not UPDATE_BASELINES:
+            limit = baseline * REGRESSION_FACTOR + REGRESSION_SLACK
+            assert (
+                median <= limit
+            ), f"{name} regressed: median {median:.4f}s, baseline {baseline:.4f}s"
+        return result
+
+    return run
@@ -0,0 +1,116 @@
+import psycopg
+import pytest
+
+from logrepl.commands.schema import create_database
+from logrepl.commands.verify import verify_config
+from logrepl.db import source_db, target_db
+from logrepl.logrepl import (
+    create_extension,
+    create_provider_node,
+    create_schema,
+    create_subscriber,
+    create_subscription,
+    init_replication_set,
+    setup_replication_user,
+    synchronize_sequences,
+    teardown_subscription,
+)
+
+from .conftest import wait_for
+
+pytestmark = pytest.mark.benchmark
+
+
+def drop_target_database(clusters, config):
+    _, target = clusters
+    with target.connect() as conn:
+        conn.execute(f"DROP DATABASE IF EXISTS {config['target']['dbname']}")
+
+
+def prepare_provider_and_subscriber(config, file):
+    create_database(config)
+    create_extension(config)
+    create_schema(config, file)
+    # Grants on the pglogical schema and the restored schemas.
+    setup_replication_user(config)
+    create_provider_node(config)
+    init_replication_set(config)
+    create_subscriber(config)
+
+
+def test_connection_overhead(config, benchmark):
+    def connect():
+        with source_db(config):
+            pass
+
+    benchmark(connect, rounds=20)
+
+
+def test_verify_config(config, benchmark):
+    benchmark(verify_config, config)
+
+
+def test_schema_dump_restore(clusters, config, benchmark, tmp_path):
+    source, _ = clusters
+    with source.connect(config["source"]["dbname"]) as conn:
+        for i in range(50):
+            conn.execute(
+                f"CREATE TABLE table_{i} (id serial PRIMARY KEY, value text, "
+                f"created timestamptz DEFAULT now())"
+            )
+            conn.execute(f"CREATE INDEX table_{i}_value_idx ON table_{i} (value)")
+
+    benchmark(
+        create_schema,
+        config,
+        str(tmp_path / "schema.sql"),
+        setup=lambda: drop_target_database(clusters, config),
+    )
+
+
+@pytest.mark.parametrize("rows", [1_000, 10_000, 100_000])
+def test_initial_sync(clusters, config, benchmark, requires_pglogical, rows, tmp_path):
+    source, _ = clusters
+    with source.connect(config["source"]["dbname"]) as conn:
+        conn.execute("CREATE TABLE events (id bigserial PRIMARY KEY, payload text)")
+        conn.execute(
+            "INSERT INTO events (payload) SELECT md5(g::text) "
+            "FROM generate_series(1, %s) g",
+            [rows],
+        )
+    prepare_provider_and_subscriber(config, str(tmp_path / "schema.sql"))
+
+    def reset():
+        try:
+            teardown_subscription(config)
+        except psycopg.Error:
+            pass
+        with target_db(config) as conn:
+            conn.execute("TRUNCATE events")
+            conn.commit()
+
+    def synchronized():
+        with target_db(config) as conn:
+            return conn.execute("SELECT count(*) FROM events").fetchone()[0] == rows
+
+    def sync():
+        create_subscription(config)
+        wait_for(synchronized, timeout=600)
+
+    benchmark(sync, rounds=3, setup=reset)
+    teardown_subscription(config)
+
+
+def test_sequence_sync(clusters, config, benchmark, requires_pglogical, tmp_path):
+    source, _ = clusters
+    with source.connect(config["source"]["dbname"]) as conn:
+        for i in range(100):
+            conn.execute(f"CREATE SEQUENCE sequence_{i}")
+            conn.execute(f"SELECT setval('sequence_{i}', {i + 1})")
+    create_database(config)
+    create_extension(config)
+    create_schema(config, str(tmp_path / "schema.sql"))
+    create_provider_node(config)
+    init_replication_set(config)
+
+    benchmark(synchronize_sequences, config)
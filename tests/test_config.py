@@ -0,0 +1,36 @@
+from logrepl.config import replication_groups, schemas
+
+
+def make_config(schema=None):
+    config = {
+        "source": {"replication_set": "example"},
+        "target": {"subscription": "example_subscription"},
+    }
+    if schema is not None:
+        config["source"]["schema"] = schema
+    return config
+
+
+def test_public_schema_by_default():
+    config = make_config()
+    assert schemas(config) == ["public"]
+    assert replication_groups(config) == [
+        ("example", "example_subscription", ["public"])
+    ]
+
+
+def test_single_group_keeps_configured_names():
+    config = make_config("public, sales")
+    assert replication_groups(config) == [
+        ("example", "example_subscription", ["public", "sales"])
+    ]
+
+
+def test_each_group_gets_its_own_set_and_subscription():
+    config = make_config("public; sales, billing ;audit")
+    assert schemas(config) == ["public", "sales", "billing", "audit"]
+    assert replication_groups(config) == [
+        ("example_public", "example_subscription_public", ["public"]),
+        ("example_sales", "example_subscription_sales", ["sales", "billing"]),
+        ("example_audit", "example_subscription_audit", ["audit"]),
+    ]
@@ -0,0 +1,240 @@
+import contextlib
+
+from logrepl.commands import diff
+from logrepl.commands.diff import diff_catalogs, empty_catalog
+
+
+def catalog(dependencies=None, **objects):
+    result = empty_catalog()
+    for kind, values in objects.items():
+        result[kind].update(values)
+    result["dependencies"] = dependencies or {}
+    return result
+
+
+def test_new_objects_follow_their_dependencies():
+    source = catalog(
+        functions={"public.active()": "CREATE FUNCTION public.active() ..."},
+        tables={"public.users": {"id": ("integer", True, None, "", "")}},
+        dependencies={("functions", "public.active()"): {("tables", "public.users")}},
+    )
+    changes, extra = diff_catalogs(source, catalog())
+
+    assert [(kind, name) for kind, name, _, _ in changes] == [
+        ("tables", "public.users"),
+        ("functions", "public.active()"),
+    ]
+    assert changes[1][3] == {("tables", "public.users")}
+    assert changes[0][2] == ["CREATE TABLE public.users (\n    id integer NOT NULL\n)"]
+    assert extra == []
+
+
+def test_unchanged_dependencies_are_dropped():
+    users = {"public.users": {"id": ("integer", True, None, "", "")}}
+    source = catalog(
+        tables=users,
+        views={"public.v": ("v", " SELECT 1")},
+        dependencies={("views", "public.v"): {("tables", "public.users")}},
+    )
+    changes, _ = diff_catalogs(source, catalog(tables=users))
+
+    assert changes == [
+        ("views", "public.v", ["CREATE OR REPLACE VIEW public.v AS  SELECT 1"], set())
+    ]
+
+
+def test_replaced_views_follow_the_views_they_read():
+    source = catalog(
+        views={"public.b": ("v", " SELECT 2"), "public.a": ("v", " SELECT 1")},
+        dependencies={("views", "public.b"): {("views", "public.a")}},
+    )
+    target = catalog(
+        views={"public.b": ("v", " SELECT 0"), "public.a": ("v", " SELECT 0")}
+    )
+    changes, _ = diff_catalogs(source, target)
+
+    assert [name for _, name, _, _ in changes] == ["public.a", "public.b"]
+
+
+def test_enum_values_keep_their_position():
+    source = catalog(types={"public.mood": ("e", ["new", "sad", "meh", "happy"])})
+    target = catalog(types={"public.mood": ("e", ["sad", "happy"])})
+    changes, _ = diff_catalogs(source, target)
+
+    assert changes[0][2] == [
+        "ALTER TYPE public.mood ADD VALUE 'new' BEFORE 'sad'",
+        "ALTER TYPE public.mood ADD VALUE 'meh' AFTER 'sad'",
+    ]
+
+
+def test_domains_composites_and_ranges():
+    source = catalog(
+        types={
+            "public.positive": (
+                "d",
+                "integer",
+                True,
+                None,
+                {"positive_check": "CHECK (VALUE > 0)"},
+            ),
+            "public.pair": ("c", {"a": "integer", "b": "text"}),
+            "public.floats": ("r", "double precision", None, "float8mi", None),
+        }
+    )
+    target = catalog(
+        types={"public.pair": ("c", {"a": "bigint"})},
+    )
+    changes, _ = diff_catalogs(source, target)
+
+    assert {name: statements for _, name, statements, _ in changes} == {
+        "public.positive": [
+            "CREATE DOMAIN public.positive AS integer NOT NULL "
+            "CONSTRAINT positive_check CHECK (VALUE > 0)"
+        ],
+        "public.pair": [
+            "ALTER TYPE public.pair ALTER ATTRIBUTE a TYPE integer",
+            "ALTER TYPE public.pair ADD ATTRIBUTE b text",
+        ],
+        "public.floats": [
+            "CREATE TYPE public.floats AS RANGE "
+            "(SUBTYPE = double precision, SUBTYPE_DIFF = float8mi)"
+        ],
+    }
+
+
+def test_recreated_matview_restores_indexes_and_dependent_views():
+    index = "CREATE UNIQUE INDEX m_idx ON public.m USING btree (a)"
+    dependencies = {
+        ("indexes", "public.m_idx"): {("views", "public.m")},
+        ("views", "public.v"): {("views", "public.m")},
+    }
+    source = catalog(
+        views={"public.m": ("m", " SELECT 2 AS a"), "public.v": ("v", " SELECT 3")},
+        indexes={"public.m_idx": index},
+        dependencies=dependencies,
+    )
+    target = catalog(
+        views={"public.m": ("m", " SELECT 1 AS a"), "public.v": ("v", " SELECT 3")},
+        indexes={"public.m_idx": index},
+        dependencies=dependencies,
+    )
+    changes, _ = diff_catalogs(source, target)
+
+    assert [(kind, name, statements) for kind, name, statements, _ in changes] == [
+        (
+            "views",
+            "public.m",
+            [
+                "DROP MATERIALIZED VIEW public.m CASCADE",
+                "CREATE MATERIALIZED VIEW public.m AS  SELECT 2 AS a WITH NO DATA",
+            ],
+        ),
+        ("indexes", "public.m_idx", [index]),
+        ("views", "public.v", ["CREATE OR REPLACE VIEW public.v AS  SELECT 3"]),
+    ]
+
+
+def test_dependency_cycles_are_broken():
+    source = catalog(
+        functions={"public.f()": "f", "public.g()": "g"},
+        dependencies={
+            ("functions", "public.f()"): {("functions", "public.g()")},
+            ("functions", "public.g()"): {("functions", "public.f()")},
+        },
+    )
+    changes, _ = diff_catalogs(source, catalog())
+
+    assert [name for _, name, _, _ in changes] == ["public.f()", "public.g()"]
+    assert changes[0][3] == set()
+    assert changes[1][3] == {("functions", "public.f()")}
+
+
+class FakeConnection:
+    autocommit = False
+
+    def execute(self, query):
+        pass
+
+
+def test_apply_schema_diff_applies_dependency_cycles(monkeypatch):
+    source = catalog(
+        functions={"public.f()": "f", "public.g()": "g"},
+        dependencies={
+            ("functions", "public.f()"): {("functions", "public.g()")},
+            ("functions", "public.g()"): {("functions", "public.f()")},
+        },
+    )
+    applied = []
+    monkeypatch.setattr(diff, "create_database", lambda config: None)
+    monkeypatch.setattr(
+        diff, "schema_diff", lambda config: diff_catalogs(source, catalog())
+    )
+    monkeypatch.setattr(
+        diff, "target_db", lambda config: contextlib.nullcontext(FakeConnection())
+    )
+    monkeypatch.setattr(
+        diff,
+        "apply_change",
+        lambda conn, kind, name, statements: applied.append(name),
+    )
+
+    assert diff.apply_schema_diff({}, jobs=2) == []
+    assert applied == ["public.f()", "public.g()"]
+
+
+def test_triggers_and_sequence_owners():
+    trigger = (
+        "CREATE TRIGGER t BEFORE UPDATE ON public.users "
+        "FOR EACH ROW EXECUTE FUNCTION public.touch()"
+    )
+    users = {"public.users": {"id": ("integer", True, None, "", "")}}
+    source = catalog(
+        tables=users,
+        sequences={"public.users_id_seq": ("integer", 1, 1, 2147483647, 1, False)},
+        triggers={"public.users.t": ("public.users", "t", trigger)},
+        sequence_owners={"public.users_id_seq": "public.users.id"},
+        dependencies={
+            ("sequence_owners", "public.users_id_seq"): {
+                ("sequences", "public.users_id_seq"),
+                ("tables", "public.users"),
+            },
+        },
+    )
+    changes, _ = diff_catalogs(source, catalog(tables=users))
+
+    assert [(kind, statements) for kind, _, statements, _ in changes] == [
+        (
+            "sequences",
+            [
+                "CREATE SEQUENCE public.users_id_seq AS integer INCREMENT BY 1 "
+                "MINVALUE 1 MAXVALUE 2147483647 START WITH 1 NO CYCLE"
+            ],
+        ),
+        ("triggers", [trigger]),
+        (
+            "sequence_owners",
+            ["ALTER SEQUENCE public.users_id_seq OWNED BY public.users.id"],
+        ),
+    ]
+    assert changes[2][3] == {("sequences", "public.users_id_seq")}
+
+
+def test_columns_only_on_target_are_reported():
+    source = catalog(tables={"public.t": {"a": ("integer", False, None, "", "")}})
+    target = catalog(
+        tables={
+            "public.t": {
+                "a": ("integer", False, None, "", ""),
+                "b": ("text", False, None, "", ""),
+            }
+        }
+    )
+    assert diff_catalogs(source, target) == ([], [("columns", "public.t.b")])
+
+
+def test_objects_only_on_target_are_reported():
+    target = catalog(
+        tables={"public.old": {"id": ("integer", True, None, "", "")}},
+        dependencies={("tables", "public.old"): {("schemas", "public")}},
+    )
+    assert diff_catalogs(catalog(), target) == ([], [("tables", "public.old")])
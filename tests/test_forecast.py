@@ -0,0 +1,39 @@
+from logrepl.forecast import LagWindow
+
+
+def test_needs_two_samples():
+    window = LagWindow(10)
+    assert window.forecast() is None
+    window.add(0, 1000, 0)
+    assert window.forecast() is None
+
+
+def test_catching_up():
+    window = LagWindow(10)
+    window.add(0, 1000, 0)
+    window.add(10, 2000, 1500)
+    forecast = window.forecast()
+    assert forecast["wal_rate"] == 100
+    assert forecast["apply_rate"] == 150
+    assert forecast["catchup_seconds"] == 10
+    assert not forecast["diverging"]
+    assert forecast["projected_lag"] == 0
+
+
+def test_diverging():
+    window = LagWindow(10)
+    window.add(0, 1000, 0)
+    window.add(10, 2000, 500)
+    forecast = window.forecast(horizon=100)
+    assert forecast["catchup_seconds"] is None
+    assert forecast["diverging"]
+    assert forecast["projected_lag"] == 1500 + 50 * 100
+
+
+def test_window_is_bounded():
+    window = LagWindow(3)
+    for i in range(10):
+        window.add(i, i * 100, i * 100)
+    assert len(window.samples) == 3
+    assert window.samples[0] == (7, 700, 700)
+    assert window.forecast()["catchup_seconds"] == 0
@@ -0,0 +1,224 @@
+from logrepl.commands import largeobjects
+from logrepl.commands.diff import apply_schema_diff, schema_diff
+from logrepl.commands.matviews import refresh_materialized_views
+from logrepl.commands.schema import (
+    create_database,
+    dump_schema,
+    restore_schema,
+    stream_schema,
+)
+from logrepl.commands.status import subscription_status
+from logrepl.commands.verify import verify_config
+from logrepl.db import target_db
+from logrepl.logrepl import (
+    create_extension,
+    create_provider_node,
+    create_schema,
+    create_subscriber,
+    create_subscription,
+    init_replication_set,
+    setup_replication_user,
+    teardown_all,
+)
+
+from .conftest import wait_for
+
+
+SCHEMA = """
+CREATE TYPE mood AS ENUM ('sad', 'ok', 'happy');
+CREATE TABLE authors (id serial PRIMARY KEY, name text NOT NULL, mood mood);
+CREATE TABLE books (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    author_id integer REFERENCES authors (id),
+    title text DEFAULT 'untitled'
+);
+CREATE INDEX books_title_idx ON books (title);
+CREATE VIEW happy_authors AS SELECT * FROM authors WHERE mood = 'happy';
+"""
+
+
+def create_source_schema(clusters, config):
+    source, _ = clusters
+    with source.connect(config["source"]["dbname"]) as conn:
+        conn.execute(SCHEMA)
+        conn.execute(
+            "INSERT INTO authors (name, mood) "
+            "SELECT 'author ' || g, 'happy' FROM generate_series(1, 100) g"
+        )
+
+
+def target_count(config, table):
+    with target_db(config) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT count(*) FROM {table}")
+            return cur.fetchone()[0]
+
+
+def test_verify_config(config, has_pglogical):
+    assert verify_config(config) is has_pglogical
+
+
+def test_schema_dump_restore(clusters, config, tmp_path):
+    create_source_schema(clusters, config)
+    file = str(tmp_path / "schema.sql")
+
+    dump_schema(config, file)
+    restore_schema(config, file)
+
+    assert target_count(config, "authors") == 0
+    assert target_count(config, "happy_authors") == 0
+
+
+def test_stream_schema_reports_failed_statements(clusters, config, tmp_path):
+    create_source_schema(clusters, config)
+    report = str(tmp_path / "errors.json")
+
+    assert stream_schema(config, report) == []
+    assert target_count(config, "authors") == 0
+
+    errors = stream_schema(config, report)
+    assert errors
+    assert all("already exists" in error["error"] for error in errors)
+    assert any("CREATE TABLE public.authors" in error["statement"] for error in errors)
+
+
+def test_schema_diff_apply(clusters, config):
+    create_source_schema(clusters, config)
+    create_database(config)
+
+    assert apply_schema_diff(config) == []
+    changes, extra = schema_diff(config)
+    assert changes == []
+    assert extra == []
+
+    source, _ = clusters
+    with source.connect(config["source"]["dbname"]) as conn:
+        conn.execute("ALTER TABLE authors ADD COLUMN born date")
+
+    changes, _ = schema_diff(config)
+    assert changes == [
+        (
+            "tables",
+            "public.authors",
+            ["ALTER TABLE public.authors ADD COLUMN born date"],
+            set(),
+        )
+    ]
+
+
+def test_refresh_materialized_views(clusters, config, tmp_path):
+    create_source_schema(clusters, config)
+    source, _ = clusters
+    with source.connect(config["source"]["dbname"]) as conn:
+        conn.execute(
+            "CREATE MATERIALIZED VIEW author_moods AS "
+            "SELECT mood, count(*) AS authors FROM happy_authors GROUP BY mood"
+        )
+        conn.execute("CREATE UNIQUE INDEX ON author_moods (mood)")
+        conn.execute(
+            "CREATE MATERIALIZED VIEW mood_total AS "
+            "SELECT sum(authors) AS authors FROM author_moods"
+        )
+    file = str(tmp_path / "schema.sql")
+    dump_schema(config, file)
+    restore_schema(config, file)
+    with target_db(config) as conn:
+        conn.execute("INSERT INTO authors (name, mood) VALUES ('someone', 'happy')")
+        conn.commit()
+
+    assert refresh_materialized_views(config)
+    # Populated with a unique index, the second refresh runs concurrently.
+    assert refresh_materialized_views(config)
+    assert target_count(config, "author_moods") == 1
+    with target_db(config) as conn:
+        assert conn.execute("SELECT authors FROM mood_total").fetchone()[0] == 1
+
+
+def test_sync_large_objects(clusters, config, monkeypatch):
+    source, target = clusters
+    dbname = config["source"]["dbname"]
+    with source.connect(dbname) as conn:
+        conn.execute("SELECT lo_from_bytea(424242, %s)", [b"changed" * 500])
+        conn.execute("SELECT lo_from_bytea(424243, %s)", [b"unchanged"])
+        # Roles are shared by the databases of a cluster, create them once.
+        conn.execute(
+            "DO $$ BEGIN CREATE ROLE lo_reader; "
+            "EXCEPTION WHEN duplicate_object THEN NULL; END $$"
+        )
+        conn.execute("ALTER LARGE OBJECT 424243 OWNER TO lo_reader")
+        conn.execute("GRANT SELECT ON LARGE OBJECT 424242 TO lo_reader")
+    with target.connect() as conn:
+        conn.execute(
+            "DO $$ BEGIN CREATE ROLE lo_reader; "
+            "EXCEPTION WHEN duplicate_object THEN NULL; END $$"
+        )
+    create_database(config)
+
+    copied = []
+    copy_large_object = largeobjects.copy_large_object
+
+    def record_copy(source, target, oid, *args):
+        copied.append(oid)
+        copy_large_object(source, target, oid, *args)
+
+    monkeypatch.setattr(largeobjects, "copy_large_object", record_copy)
+
+    def target_object(oid):
+        with target.connect(dbname) as conn:
+            return bytes(conn.execute("SELECT lo_get(%s)", [oid]).fetchone()[0])
+
+    # Copied with their OIDs, in chunks smaller than the objects.
+    assert largeobjects.sync_large_objects(config, jobs=2, chunk_size=1024)
+    assert sorted(copied) == [424242, 424243]
+    assert target_object(424242) == b"changed" * 500
+    assert target_object(424243) == b"unchanged"
+    with target.connect(dbname) as conn:
+        assert largeobjects.large_object_metadata(conn, 424243)[0] == "lo_reader"
+        assert largeobjects.large_object_metadata(conn, 424242)[1] == [
+            ("lo_reader", "SELECT", False)
+        ]
+
+    # The matching object is skipped, the changed one is overwritten in place and
+    # truncated to its new, shorter size.
+    with source.connect(dbname) as conn:
+        conn.execute("SELECT lo_unlink(424242)")
+        conn.execute("SELECT lo_from_bytea(424242, %s)", [b"short"])
+    copied.clear()
+    assert largeobjects.sync_large_objects(config, jobs=2, chunk_size=1024)
+    assert copied == [424242]
+    assert target_object(424242) == b"short"
+    assert target_object(424243) == b"unchanged"
+
+
+def test_setup_status_teardown(clusters, config, requires_pglogical, tmp_path):
+    create_source_schema(clusters, config)
+    create_database(config)
+    # The steps of setup, with the replication user created once the pglogical
+    # extension and the schema exist on the target, as in the README.
+    create_extension(config)
+    create_schema(config, str(tmp_path / "schema.sql"))
+    setup_replication_user(config)
+    create_provider_node(config)
+    init_replication_set(config)
+    create_subscriber(config)
+    create_subscription(config)
+
+    def replicating():
+        with target_db(config) as conn:
+            return (
+                subscription_status(conn, config["target"]["subscription"])
+                == "replicating"
+            )
+
+    def synchronized():
+        return target_count(config, "authors") == 100
+
+    wait_for(replicating)
+    wait_for(synchronized)
+
+    teardown_all(config)
+
+    with target_db(config) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM pglogical.subscription")
+            assert cur.fetchone()[0] == 0
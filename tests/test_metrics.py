@@ -0,0 +1,88 @@
+from prometheus_client import REGISTRY
+
+from logrepl.commands import metrics
+
+
+def test_sample_age_grows_until_next_sample(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(metrics, "clock", lambda: now)
+    monkeypatch.setattr(metrics, "last_samples", {})
+
+    metrics.track_sample_age("test_family")
+    metrics.record_sample("test_family")
+    now = 1300.0
+
+    labels = {"metric": "test_family"}
+    assert REGISTRY.get_sample_value("last_sample_age_seconds", labels) == 300.0
+    assert REGISTRY.get_sample_value("last_sample_timestamp_seconds", labels) == 1000.0
+
+    metrics.record_sample("test_family")
+    assert REGISTRY.get_sample_value("last_sample_age_seconds", labels) == 0.0
+
+    metrics.SAMPLE_AGE.remove("test_family")
+    metrics.LAST_SAMPLE.remove("test_family")
+
+
+def test_change_rates_skip_new_and_reset_tables():
+    previous = (0.0, {"a": (10, 0, 0), "b": (100, 50, 5)})
+    current = (10.0, {"a": (110, 20, 0), "b": (0, 0, 0), "c": (5, 0, 0)})
+    assert metrics.change_rates(previous, current) == {"a": [10.0, 2.0, 0.0]}
+
+
+def test_publish_table_changes_keeps_top_tables():
+    config = {"source": {"dbname": "test_top_tables"}}
+    labels = {"side": "source", "database": "test_top_tables", "operation": "insert"}
+
+    def rate(table):
+        return REGISTRY.get_sample_value(
+            "table_change_rate", {**labels, "table": table}
+        )
+
+    rates = {
+        "source": {"a": [3.0, 0, 0], "b": [2.0, 0, 0], "c": [1.0, 0, 0]},
+        "target": {"a": [1.0, 0, 0]},
+    }
+    published = metrics.publish_table_changes(config, rates, set(), 2)
+    assert published == {"a", "b"}
+    assert rate("a") == 3.0
+    assert rate("c") is None
+    assert (
+        REGISTRY.get_sample_value(
+            "table_change_rate_difference",
+            {"database": "test_top_tables", "table": "a", "operation": "insert"},
+        )
+        == 2.0
+    )
+
+    rates["source"]["c"] = [10.0, 0, 0]
+    published = metrics.publish_table_changes(config, rates, published, 2)
+    assert published == {"a", "c"}
+    assert rate("b") is None
+
+    empty = {"source": {}, "target": {}}
+    assert metrics.publish_table_changes(config, empty, published, 2) == set()
+    assert rate("a") is None
+
+
+def test_disconnected_subscription_series_are_removed():
+    config = {"source": {"host": "db", "dbname": "test_lag"}}
+    labels = {
+        "host": "db",
+        "client": "10.0.0.1",
+        "state": "streaming",
+        "database": "test_lag",
+        "application_name": "sub",
+    }
+    windows = {}
+    published = {}
+    row = ("sub", "10.0.0.1", "streaming", 42, 100, 58)
+
+    rows = [("sub", row)]
+    assert metrics.publish_replication_lag(config, rows, windows, published) == 1
+    assert REGISTRY.get_sample_value("replication_lag", labels) == 42
+
+    rows = [("sub", None)]
+    assert metrics.publish_replication_lag(config, rows, windows, published) == 0
+    assert REGISTRY.get_sample_value("replication_lag", labels) is None
+    assert windows == {}
+    assert published == {}
@@ -0,0 +1,69 @@
+import contextlib
+
+import pytest
+
+from logrepl.commands import perfcheck
+from logrepl.commands.perfcheck import is_read_only, plan_nodes, scans_by_relation
+
+
+def test_is_read_only():
+    assert is_read_only("SELECT * FROM accounts WHERE id = $1")
+    assert is_read_only("  with t as (select 1) select * from t")
+    assert not is_read_only("UPDATE accounts SET balance = $1")
+    assert not is_read_only("SELECT * FROM accounts FOR UPDATE")
+    assert not is_read_only("WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d")
+
+
+def test_scans_by_relation():
+    plan = {
+        "Node Type": "Nested Loop",
+        "Plans": [
+            {"Node Type": "Seq Scan", "Relation Name": "branches"},
+            {
+                "Node Type": "Index Scan",
+                "Relation Name": "accounts",
+                "Index Name": "accounts_pkey",
+            },
+        ],
+    }
+    assert scans_by_relation(plan_nodes(plan)) == {
+        "branches": {"Seq Scan"},
+        "accounts": {"Index Scan"},
+    }
+
+
+def replay(monkeypatch, results):
+    statements = [(i, f"SELECT {i}", 1, 1.0) for i in range(len(results))]
+    statements.append((len(results), "UPDATE t SET a = 1", 1, 1.0))
+    monkeypatch.setattr(perfcheck, "source_db", lambda config: contextlib.nullcontext())
+    monkeypatch.setattr(perfcheck, "top_statements", lambda conn, limit: statements)
+    monkeypatch.setattr(
+        perfcheck,
+        "compare_statements",
+        lambda config, batch, runs, timeout: [
+            {"queryid": queryid, "query": query, **results[queryid]}
+            for queryid, query, _, _ in batch
+        ],
+    )
+
+
+def timing(source_ms, target_ms):
+    return {
+        "source_ms": source_ms,
+        "target_ms": target_ms,
+        "ratio": target_ms / source_ms,
+        "plan_changed": False,
+        "lost_indexes": [],
+    }
+
+
+def test_perfcheck_returns_regressions(monkeypatch):
+    replay(monkeypatch, [timing(1.0, 1.1), timing(1.0, 3.0), {"error": "boom"}])
+    regressions = perfcheck.perfcheck({}, jobs=2)
+    assert [result["queryid"] for result in regressions] == [1]
+
+
+def test_perfcheck_fails_when_too_few_statements_compared(monkeypatch):
+    replay(monkeypatch, [timing(1.0, 1.0), {"error": "boom"}, {"error": "boom"}])
+    with pytest.raises(SystemExit):
+        perfcheck.perfcheck({})
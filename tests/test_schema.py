@@ -0,0 +1,32 @@
+from logrepl.commands.schema import collect_psql_errors, schema_pattern
+
+
+def test_collect_psql_errors():
+    stderr = [
+        b'psql:<stdin>:12: ERROR:  relation "authors" already exists\n',
+        b"LINE 1: CREATE TABLE authors (id integer);\n",
+        b'psql:<stdin>:40: NOTICE:  extension "citext" already exists, skipping\n',
+        b'psql: error: connection to server failed: FATAL:  role "x" does not exist\n',
+    ]
+    errors = []
+    output = []
+    collect_psql_errors(stderr, errors, output)
+
+    assert errors == [
+        {
+            "line": 12,
+            "error": 'relation "authors" already exists',
+            "detail": ["LINE 1: CREATE TABLE authors (id integer);"],
+        },
+        {
+            "line": None,
+            "error": 'connection to server failed: FATAL:  role "x" does not exist',
+            "detail": [],
+        },
+    ]
+    assert len(output) == 4
+
+
+def test_schema_pattern():
+    assert schema_pattern("Sales") == '"Sales"'
+    assert schema_pattern('we"ird*') == '"we""ird*"'